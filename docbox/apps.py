@@ -1,7 +1,16 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 
+from docbox.signals.balance import (
+    store_previous_balance_amount,
+    store_previous_total,
+    update_client_balance,
+    update_order_client_balance,
+)
+from docbox.signals.cashbox import invalidate_checkpoints, store_previous_date
+from docbox.signals.changelog import log_delete, log_save
 from docbox.signals.order import update_status
+from docbox.signals.price import store_previous_order, update_provider_cost
 
 
 class DocboxConfig(AppConfig):
@@ -9,4 +18,23 @@ class DocboxConfig(AppConfig):
     verbose_name = "Docbox"
 
     def ready(self):
+        pre_save.connect(store_previous_order, sender="docbox.ProviderOrder")
+        post_save.connect(update_provider_cost, sender="docbox.ProviderOrder")
+        post_delete.connect(update_provider_cost, sender="docbox.ProviderOrder")
         post_save.connect(update_status, sender="docbox.ProviderOrder")
+
+        for sender in ["docbox.Order", "docbox.Transaction"]:
+            pre_save.connect(store_previous_balance_amount, sender=sender)
+            pre_delete.connect(store_previous_balance_amount, sender=sender)
+            post_save.connect(update_client_balance, sender=sender)
+            post_delete.connect(update_client_balance, sender=sender)
+        pre_save.connect(store_previous_total, sender="docbox.Price")
+        post_save.connect(update_order_client_balance, sender="docbox.Price")
+
+        pre_save.connect(store_previous_date, sender="docbox.Transaction")
+        post_save.connect(invalidate_checkpoints, sender="docbox.Transaction")
+        post_delete.connect(invalidate_checkpoints, sender="docbox.Transaction")
+
+        for sender in ["docbox.Order", "docbox.ProviderOrder", "docbox.Transaction"]:
+            post_save.connect(log_save, sender=sender)
+            post_delete.connect(log_delete, sender=sender)
@@ -1 +1,6 @@
-from .tbot_client import send_delivery_info
+from .tbot_client import (
+    create_delivery_messages,
+    group_orders_by_delivery_date,
+    queue_delivery_info,
+    send_message_to_bot,
+)
@@ -1,51 +1,52 @@
-import logging
+from itertools import groupby
+from operator import itemgetter
 
-import requests
 from django.conf import settings
 
-logger = logging.getLogger(__name__)
+from docbox.models import DeliveryNotification
 
+# Telegram doesn't accept longer messages, longer lists of orders are split.
+MAX_MESSAGE_LENGTH = 4096
+TIMEOUT = 5
 
-def send_delivery_info(orders: list) -> None:
-    grouped_orders = group_orders_by_delivery_date(orders)
-    messages = create_delivery_messages(grouped_orders)
-    for message in messages:
-        send_message_to_bot(message)
 
+def queue_delivery_info(orders: list) -> None:
+    """Queue delivery notifications in the current transaction, they are sent by sendnotifications command."""
+    DeliveryNotification.objects.enqueue(orders)
 
-def group_orders_by_delivery_date(orders):
-    grouped_orders = {}
-    for order in orders:
-        if order.delivery_date not in grouped_orders:
-            grouped_orders.update({order.delivery_date: [order]})
-            continue
-        grouped_orders[order.delivery_date].append(order)
 
-    return grouped_orders
+def group_orders_by_delivery_date(rows):
+    """Group `ProviderOrderQuerySet.delivery_rows` by delivery date, rows are already ordered by it."""
+    return {
+        delivery_date: list(date_rows) for delivery_date, date_rows in groupby(rows, key=itemgetter("delivery_date"))
+    }
 
 
 def create_delivery_messages(grouped_orders):
     messages = []
-    for delivery_date, orders_list in grouped_orders.items():
-        message = f"Доставка {delivery_date.isoformat()}\n\n\n"
-        for provider_order in orders_list:
-            message += f"*{provider_order.code}*: {provider_order.order.client.name}\n"
-            if provider_order.order_content:
-                message += f"{provider_order.order_content}\n"
-            message += f"долг клиента: {provider_order.order.client.remaining}\n\n"
+    for delivery_date, rows in grouped_orders.items():
+        header = f"Доставка {delivery_date.isoformat()}\n\n\n"
+        message = header
+        for row in rows:
+            order_info = f"*{row['code']}*: {row['client_name']}\n"
+            if row["order_content"]:
+                order_info += f"{row['order_content']}\n"
+            order_info += f"долг клиента: {row['client_remaining']}\n\n"
+
+            if message != header and len(message) + len(order_info) > MAX_MESSAGE_LENGTH:
+                messages.append(message)
+                message = header
+            message += order_info
         messages.append(message)
 
     return messages
 
 
-def send_message_to_bot(message):
-    try:
-        requests.post(
-            settings.TELEGRAM_SEND_MESSAGE_URL,
-            json={"chat_id": settings.TELEGRAM_ZAOKNOM_CHAT_ID, "parse_mode": "MarkdownV2", "text": message},
-            timeout=5,
-        )
-    except Exception as e:
-        logger.error(f"Got error during request to the bot: {e}")
-        return False
-    return True
+def send_message_to_bot(session, message):
+    """Send message with the `session` of requests library, raises RequestException if it wasn't sent."""
+    response = session.post(
+        settings.TELEGRAM_SEND_MESSAGE_URL,
+        json={"chat_id": settings.TELEGRAM_ZAOKNOM_CHAT_ID, "parse_mode": "MarkdownV2", "text": message},
+        timeout=TIMEOUT,
+    )
+    response.raise_for_status()
@@ -1,31 +1,59 @@
 import json
 import os
-from typing import BinaryIO, ContextManager
+import threading
+from typing import BinaryIO
 
+import httplib2
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
 
 SCOPES = ["https://www.googleapis.com/auth/drive.file"]
-GOOGLE_SERVICE_ACCOUNT_CREDS = json.loads(os.getenv("GOOGLE_SERVICE_ACCOUNT_CREDS"))
-GDRIVE_CREDENTIALS = service_account.Credentials.from_service_account_info(
-    GOOGLE_SERVICE_ACCOUNT_CREDS, scopes=SCOPES
-)
-GDRIVE_BACKUP_FOLDER_ID = os.getenv("GDRIVE_BACKUP_FOLDER_ID")
+# Resumable upload chunks must be a multiple of 256 KiB.
+CHUNK_SIZE = 20 * 256 * 1024
+# Retries of each chunk on connection errors, 5xx and 429 responses with exponential backoff.
+NUM_RETRIES = 5
 
+_credentials = None
+_service = None
+_service_lock = threading.Lock()
+_local = threading.local()
 
-def get_service(gdrive_credentials=GDRIVE_CREDENTIALS) -> ContextManager:
-    return build("drive", "v3", credentials=gdrive_credentials)
+
+def get_service():
+    """Return drive service, it's built on the first call and reused after.
+
+    Credentials are read here and not at import time,
+    so commands which import this module work without them.
+    """
+    global _credentials, _service
+    with _service_lock:
+        if _service is None:
+            _credentials = service_account.Credentials.from_service_account_info(
+                json.loads(os.environ["GOOGLE_SERVICE_ACCOUNT_CREDS"]), scopes=SCOPES
+            )
+            _service = build("drive", "v3", credentials=_credentials, cache_discovery=False)
+    return _service
+
+
+def get_http():
+    """Return authorized http for the current thread, because httplib2 isn't thread safe."""
+    if not hasattr(_local, "http"):
+        get_service()
+        _local.http = AuthorizedHttp(_credentials, http=httplib2.Http())
+    return _local.http
 
 
 def upload_file(name: str, bytes_stream: BinaryIO, file_mimetype: str) -> tuple:
-    file_metadata = {"name": name, "parents": [GDRIVE_BACKUP_FOLDER_ID]}
-    with get_service() as drive_service:
-        media = MediaIoBaseUpload(bytes_stream, mimetype=file_mimetype)
-        response = (
-            drive_service.files()
-            .create(body=file_metadata, media_body=media, fields="id, name, size")
-            .execute()
-        )
-
-    return tuple(response.values())
+    """Upload file with resumable upload by chunks and return its id, name and size."""
+    file_metadata = {"name": name, "parents": [os.getenv("GDRIVE_BACKUP_FOLDER_ID")]}
+    media = MediaIoBaseUpload(bytes_stream, mimetype=file_mimetype, chunksize=CHUNK_SIZE, resumable=True)
+    request = get_service().files().create(body=file_metadata, media_body=media, fields="id, name, size")
+
+    http = get_http()
+    response = None
+    while response is None:
+        status, response = request.next_chunk(http=http, num_retries=NUM_RETRIES)
+
+    return response["id"], response["name"], response["size"]
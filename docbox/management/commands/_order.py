@@ -1,7 +1,7 @@
 import re
 from dataclasses import dataclass, field
 from datetime import date
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 
 
 @dataclass
@@ -113,7 +113,7 @@ class OrderData:
         self.status = new_status
 
     def str_to_date(self, str_date: str) -> date:
-        """ If str_date is not empty convert to date obj and return it."""
+        """ If str_date is not empty convert to date obj and return it, raise ValueError if it's invalid."""
         if not str_date:
             return ""
 
@@ -122,21 +122,21 @@ class OrderData:
 
         try:
             date_obj = date(*list(map(int, date_parts)))
-        except ValueError:
-            exit(f"Can't convert {str_date} to the date obj.")
+        except (TypeError, ValueError):
+            raise ValueError(f"Can't convert {str_date} to the date obj.")
 
         return date_obj
 
     def str_to_decimal(self, str_decimal: str) -> Decimal:
-        """ If str_decimal is not empty convert to Decimal obj and return it."""
+        """ If str_decimal is not empty convert to Decimal obj and return it, raise ValueError if it's invalid."""
         str_decimal = re.sub(r"\s*?", "", str_decimal)
         if not str_decimal:
             return Decimal(0)
 
         try:
             decimal_obj = Decimal(str_decimal)
-        except ValueError:
-            exit(f"Can't convert {str_decimal} to the Decimal obj.")
+        except InvalidOperation:
+            raise ValueError(f"Can't convert {str_decimal} to the Decimal obj.")
         return decimal_obj
 
     def __repr__(self):
@@ -0,0 +1,57 @@
+import hashlib
+
+from django.apps import apps
+
+
+def get_models():
+    """Return docbox models ordered so that every model goes after models it references."""
+    models = list(apps.get_app_config("docbox").get_models())
+    ordered = []
+    while models:
+        for model in models:
+            references = {
+                field.related_model
+                for field in model._meta.concrete_fields
+                if field.is_relation and field.related_model is not model
+            }
+            if references.issubset(ordered):
+                ordered.append(model)
+                models.remove(model)
+                break
+        else:
+            raise ValueError(f"Circular references between models: {models}")
+    return ordered
+
+
+def copy_columns(model):
+    return ", ".join(f'"{field.column}"' for field in model._meta.concrete_fields)
+
+
+class ChecksumFile:
+    """Wrap binary file to count sha256, size and lines of data passed through it."""
+
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.rows = 0
+
+    def update(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        # In COPY text format new lines inside values are escaped, so every line is a row.
+        self.rows += data.count(b"\n")
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.update(data)
+        return self.file.write(data)
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
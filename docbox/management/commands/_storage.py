@@ -0,0 +1,39 @@
+import os
+import shutil
+from typing import BinaryIO
+
+from django.conf import settings
+
+from . import _gdrive
+
+
+class GDriveStorage:
+    name = "gdrive"
+
+    def upload(self, name: str, bytes_stream: BinaryIO, file_mimetype: str) -> tuple:
+        return _gdrive.upload_file(name, bytes_stream, file_mimetype)
+
+
+class LocalStorage:
+    """Store backups in a local directory, for offline use and tests."""
+
+    name = "local"
+
+    def __init__(self, directory=None):
+        self.directory = directory or settings.BACKUP_DIR
+
+    def upload(self, name: str, bytes_stream: BinaryIO, file_mimetype: str) -> tuple:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as backup_file:
+            shutil.copyfileobj(bytes_stream, backup_file)
+
+        return path, name, os.path.getsize(path)
+
+
+STORAGES = {storage.name: storage for storage in (GDriveStorage, LocalStorage)}
+
+
+def get_storage(name=None):
+    """Return backup storage by its name, `BACKUP_STORAGE` setting is used by default."""
+    return STORAGES[name or settings.BACKUP_STORAGE]()
@@ -1,42 +1,225 @@
-import codecs
 import csv
+import gzip
+import hashlib
 import io
+import json
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
 
+from django.core import serializers
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 
-from docbox.models import Order, Transaction
+from docbox.models import (
+    Address,
+    Backup,
+    ChangeLog,
+    Client,
+    Mounter,
+    Order,
+    Price,
+    Provider,
+    ProviderOrder,
+    Transaction,
+)
 
-from ._gdrive import upload_file
+from ._storage import STORAGES, get_storage
+
+# Backups smaller than this stay in memory, bigger ones are rolled over to disk.
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+UPLOAD_WORKERS = 3
+
+
+class GzipBackup:
+    """Text file which is gzipped while it's written into a spooled temporary file."""
+
+    mimetype = "application/gzip"
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = 0
+        self.started = time.monotonic()
+
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        gzip_file = gzip.GzipFile(filename=filename.removesuffix(".gz"), mode="wb", fileobj=self.file)
+        self.text_file = io.TextIOWrapper(gzip_file, encoding="utf-8", newline="")
+
+    def finish(self):
+        """Flush compressed data and rewind the file, so it can be uploaded."""
+        # Closes gzip file too, but not the temporary file it writes to.
+        self.text_file.close()
+        self.size = self.file.tell()
+        self.seconds = time.monotonic() - self.started
+
+        self.file.seek(0)
+        sha256 = hashlib.sha256()
+        for block in iter(lambda: self.file.read(1024 * 1024), b""):
+            sha256.update(block)
+        self.sha256 = sha256.hexdigest()
+        self.file.seek(0)
+
+
+class CsvBackup(GzipBackup):
+    def __init__(self, filename, header):
+        super().__init__(filename)
+        self.writer = csv.writer(self.text_file)
+        self.writer.writerow(header)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.rows += 1
+
+
+class DataBackup(GzipBackup):
+    """Objects serialized as json lines, the file can be loaded back with loaddata."""
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.model_rows = {}
+
+    def write(self, queryset):
+        serializers.serialize("jsonl", self.count(queryset), stream=self.text_file)
+
+    def count(self, queryset):
+        label = queryset.model._meta.label
+        self.model_rows.setdefault(label, 0)
+        for obj in queryset.order_by("pk").iterator(2000):
+            self.model_rows[label] += 1
+            self.rows += 1
+            yield obj
+
+
+class ManifestFile:
+    mimetype = "application/json"
+
+    def __init__(self, filename, manifest):
+        self.filename = filename
+        self.file = io.BytesIO(json.dumps(manifest, ensure_ascii=False, indent=2).encode())
+
+
+def data_querysets(since=None):
+    """Return querysets for the data backup in the order they can be loaded.
+
+    With `since` only orders, prices, provider orders, transactions and addresses
+    changed after it are backed up, clients, providers and mounters are small, so they are always backed up.
+    """
+    addresses = Address.objects.all()
+    prices = Price.objects.all()
+    orders = Order.objects.all()
+    provider_orders = ProviderOrder.objects.all()
+    transactions = Transaction.objects.all()
+    if since:
+        prices = prices.filter(date_changed__gte=since)
+        # Order change date has no time, so orders changed at the day of the previous backup are repeated.
+        orders = orders.filter(date_changed__gte=timezone.localdate(since))
+        addresses = addresses.filter(pk__in=orders.values("address"))
+        provider_orders = provider_orders.filter(date_changed__gte=since)
+        transactions = transactions.filter(date_changed__gte=since)
+
+    return [
+        Client.objects.all(),
+        Provider.objects.all(),
+        Mounter.objects.all(),
+        addresses,
+        prices,
+        orders,
+        provider_orders,
+        transactions,
+    ]
+
+
+def deleted_ids(since):
+    """Return ids of orders, provider orders and transactions deleted since `since`, by model labels.
+
+    Deleted objects aren't in the delta, so they are deleted by restorebackup after it's loaded.
+    """
+    deleted = {}
+    changes = ChangeLog.objects.filter(action=ChangeLog.Action.DELETED, changed__gte=since)
+    for model_name, object_id in changes.values_list("model", "object_id"):
+        deleted.setdefault(ChangeLog.MODELS[model_name]._meta.label, []).append(str(object_id))
+    return deleted
 
 
 class Command(BaseCommand):
-    help = "Make backup and upload it to google-drive"
+    help = "Make backup and upload it to google-drive or to the local directory"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--storage", choices=STORAGES, help="Where to store backup, BACKUP_STORAGE setting by default."
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Back up only data changed since the previous backup, csv files aren't made.",
+        )
 
     def handle(self, *args, **options):
-        today = date.today().strftime("%Y%m%d")
-        self.upload_csv_to_gdrive(Order, "data_for_csv", f"orders_{today}.csv")
-        self.upload_csv_to_gdrive(Transaction, "data_for_csv", f"transactions_{today}.csv")
-        self.upload_csv_to_gdrive(Order, "bookkeeping_data_for_csv", f"BookkeepingOrders_{today}.csv")
+        storage = get_storage(options["storage"])
+        until = timezone.now()
+        previous = Backup.objects.first() if options["incremental"] else None
+        if options["incremental"] and not previous:
+            self.stdout.write("There is no previous backup, making full backup.")
+
+        kind = Backup.Kind.DELTA if previous else Backup.Kind.FULL
+        name = f"backup_{timezone.localtime(until).strftime('%Y%m%d%H%M%S')}_{kind}"
+        since = previous.until if previous else None
+
+        data = DataBackup(f"{name}.jsonl.gz")
+        for queryset in data_querysets(since):
+            data.write(queryset)
+        data.finish()
+        backups = [data]
+
+        if kind == Backup.Kind.FULL:
+            backups += self.make_csv_backups()
 
-    def upload_csv_to_gdrive(self, model, csv_dict, filename):
-        """Dump all items from model to csv file and upload it to gdrive.
+        for backup in backups:
+            self.stdout.write(
+                f"{backup.filename}: {backup.rows} rows, {backup.size} bytes, {backup.seconds:.2f} seconds"
+            )
 
-        `model` must have data_for_csv attribute, which is list of values needed for backup.
-        """
-        with io.BytesIO() as csv_file_obj:
+        manifest = {
+            "name": name,
+            "kind": kind,
+            "since": since.isoformat() if since else None,
+            "until": until.isoformat(),
+            "previous": previous.name if previous else None,
+            "file": data.filename,
+            "sha256": data.sha256,
+            "size": data.size,
+            "rows": data.model_rows,
+            "deleted": deleted_ids(since) if since else {},
+        }
+
+        with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+            uploads = [executor.submit(self.upload, storage, backup) for backup in backups]
+            uploads.append(executor.submit(self.upload, storage, ManifestFile(f"{name}.json", manifest)))
+            for upload in uploads:
+                file_id, filename, size = upload.result()
+                self.stdout.write(f"File {filename} ({size} bytes) uploaded to {storage.name} with id: '{file_id}'")
+
+        Backup.objects.create(name=name, kind=kind, since=since, until=until, manifest=manifest)
+
+    def make_csv_backups(self):
+        today = date.today().strftime("%Y%m%d")
 
-            # Need to do this because googleapiclient accepts only bytes objects,
-            # and csv module only works with text objects
-            wrapper = codecs.getwriter("utf-8")
-            csv_file_obj_wraper = wrapper(csv_file_obj)
+        orders = CsvBackup(f"orders_{today}.csv.gz", Order.CSV_HEADER)
+        bookkeeping_orders = CsvBackup(f"BookkeepingOrders_{today}.csv.gz", Order.BOOKKEEPING_CSV_HEADER)
+        for row, bookkeeping_row in Order.objects.backup_rows():
+            orders.writerow(row)
+            bookkeeping_orders.writerow(bookkeeping_row)
+        orders.finish()
+        bookkeeping_orders.finish()
 
-            csv_fieldnames = getattr(model.objects.first(), csv_dict).keys()
-            writer = csv.DictWriter(csv_file_obj_wraper, fieldnames=csv_fieldnames)
-            writer.writeheader()
-            for item in model.objects.all():
-                writer.writerow(getattr(item, csv_dict))
+        transactions = CsvBackup(f"transactions_{today}.csv.gz", Transaction.CSV_HEADER)
+        for row in Transaction.objects.csv_rows():
+            transactions.writerow(row)
+        transactions.finish()
 
-            id, name, size = upload_file(filename, csv_file_obj, "text/csv")
+        return [orders, transactions, bookkeeping_orders]
 
-        self.stdout.write(f"File {name} ({size} bytes) uploaded to gdrive with id: '{id}'")
+    def upload(self, storage, backup):
+        with backup.file:
+            return storage.upload(backup.filename, backup.file, backup.mimetype)
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from docbox.models import CashboxCheckpoint
+
+
+class Command(BaseCommand):
+    help = "Create daily cashbox balance checkpoints up to yesterday"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true", help="Delete all checkpoints and create them again.")
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            CashboxCheckpoint.objects.all().delete()
+
+        yesterday = timezone.localdate() - timedelta(days=1)
+        checkpoints = CashboxCheckpoint.objects.create_checkpoints(until=yesterday)
+        self.stdout.write(f"Created {len(checkpoints)} cashbox checkpoints.")
+        self.stdout.write(f"Cashbox balance: {CashboxCheckpoint.objects.balance()}")
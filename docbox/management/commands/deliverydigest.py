@@ -0,0 +1,45 @@
+from datetime import date, timedelta
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from docbox import botclient
+from docbox.models import ProviderOrder
+
+
+class Command(BaseCommand):
+    help = "Build schedule of deliveries for the day, tomorrow by default, and send it to the telegram bot"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date", help="Delivery date in iso format like 'YYYY-MM-DD'.")
+        parser.add_argument("--days", type=int, default=1, help="Number of days in the schedule.")
+        parser.add_argument("--send", action="store_true", help="Send the schedule to the bot instead of printing it.")
+
+    def handle(self, *args, **options):
+        if options["date"]:
+            try:
+                start = date.fromisoformat(options["date"])
+            except ValueError:
+                raise CommandError("Date expected to be in iso format like 'YYYY-MM-DD'")
+        else:
+            start = timezone.localdate() + timedelta(days=1)
+        end = start + timedelta(days=options["days"] - 1)
+
+        rows = ProviderOrder.objects.filter(delivery_date__range=(start, end)).delivery_rows()
+        messages = botclient.create_delivery_messages(botclient.group_orders_by_delivery_date(rows))
+        if not messages:
+            self.stdout.write(f"No deliveries from {start} to {end}.")
+            return
+
+        if not options["send"]:
+            self.stdout.write("\n".join(messages))
+            return
+
+        with requests.Session() as session:
+            try:
+                for message in messages:
+                    botclient.send_message_to_bot(session, message)
+            except requests.RequestException as error:
+                raise CommandError(f"Schedule wasn't sent: {error}")
+        self.stdout.write(f"Sent {len(messages)} messages.")
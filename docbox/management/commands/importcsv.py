@@ -1,88 +1,265 @@
 import csv
+import hashlib
+import time
+from datetime import datetime
+from datetime import time as datetime_time
+from functools import lru_cache
 from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.timezone import make_aware
 
-from docbox.models import Address, Client, Mounter, Order, Price, Transaction
+from docbox.models import (
+    Address,
+    CashboxCheckpoint,
+    ChangeLog,
+    Client,
+    ClientBalance,
+    ImportJob,
+    Mounter,
+    Order,
+    Price,
+    Transaction,
+)
 
 from ._order import OrderData
 
 
+@lru_cache(maxsize=None)
+def to_datetime(date):
+    return make_aware(datetime.combine(date, datetime_time.min))
+
+
 class Command(BaseCommand):
     help = "Imports orders from .csv file"
     missing_args_message = "Missing path to csv file."
-    orders = []
 
     def add_arguments(self, parser):
         parser.add_argument("file", type=str)
+        parser.add_argument("--batch-size", type=int, default=1000, help="Number of rows saved in one transaction.")
+        parser.add_argument("--dry-run", action="store_true", help="Only validate the file and report invalid rows.")
+        parser.add_argument(
+            "--restart", action="store_true", help="Import the file from the start even if it was imported before."
+        )
 
     def handle(self, *args, **options):
-        self.read_csv_file(options["file"])
+        csv_path = Path(options["file"]).expanduser()
+        if csv_path.suffix != ".csv":
+            raise CommandError("Expected csv file.")
 
-        for order in self.orders:
-            if not order.valid:
-                print(f"Order {order} is invalid. Skiping.")
-                continue
+        started = time.monotonic()
+        self.imported = 0
+        self.created_orders = 0
+        self.created_transactions = 0
+        self.skipped = []
+        self.client_ids = set()
 
-            try:
-                order.clean()
-            except ValueError:
-                print(f"Order {order} can't be cleaned. Skiping.")
-                continue
+        if options["dry_run"]:
+            self.validate(csv_path)
+        else:
+            self.import_file(csv_path, options["batch_size"], options["restart"])
 
-            self.save_order(order)
+        seconds = time.monotonic() - started
+        rows = self.imported + len(self.skipped)
+        self.stdout.write(
+            f"Read {rows} rows in {seconds:.2f} seconds ({rows / max(seconds, 0.001):.0f} rows/s), "
+            f"{'valid' if options['dry_run'] else 'imported'} {self.imported}, skipped {len(self.skipped)}."
+        )
+        if not options["dry_run"]:
+            self.stdout.write(f"Created {self.created_orders} orders and {self.created_transactions} transactions.")
+        for line_number, reason, order in self.skipped:
+            self.stdout.write(f"Line {line_number}: {reason}, skipped {order}")
 
-    def read_csv_file(self, csv_file: str) -> list:
-        """ Read `csv_file` and return list of Order instances."""
-        csv_path = Path(csv_file).expanduser()
+    def validate(self, csv_path):
+        """Parse and clean every line without touching the database."""
+        with csv_path.open(newline="") as csv_file:
+            for line_number, line in enumerate(csv.reader(csv_file), start=1):
+                if self.read_order(line_number, line):
+                    self.imported += 1
 
-        if csv_path.suffix != ".csv":
-            raise AttributeError("Expected csv file.")
+    def import_file(self, csv_path, batch_size, restart):
+        job, created = ImportJob.objects.get_or_create(
+            file_hash=self.file_hash(csv_path), defaults={"file_name": csv_path.name}
+        )
+        if restart:
+            job.last_line = 0
+            job.started = timezone.now()
+            job.finished = None
+            job.save()
+        elif job.finished:
+            self.stdout.write(f"File {csv_path.name} was already imported, use --restart to import it again.")
+            return
+        elif job.last_line:
+            self.stdout.write(f"Resuming import of {csv_path.name} after line {job.last_line}.")
+            # Balances of clients from the batches saved before the interruption weren't refreshed.
+            self.client_ids.update(
+                Order.objects.filter(date_changed__gte=timezone.localdate(job.started)).values_list("client", flat=True)
+            )
+
+        self.load_caches()
+        with csv_path.open(newline="") as csv_file:
+            batch = []
+            line_number = job.last_line
+            for line_number, line in enumerate(csv.reader(csv_file), start=1):
+                if line_number <= job.last_line:
+                    continue
+
+                order = self.read_order(line_number, line)
+                if order:
+                    batch.append(order)
+                if len(batch) == batch_size:
+                    self.save_batch(batch, job, line_number)
+                    batch = []
+            self.save_batch(batch, job, line_number)
 
-        with csv_path.open(newline="") as csvfile:
-            orders = [OrderData(*line) for line in csv.reader(csvfile)]
+        # Bulk inserts don't send signals, balances are refreshed once for all clients of imported orders.
+        client_ids = list(self.client_ids)
+        for start in range(0, len(client_ids), batch_size):
+            ClientBalance.objects.refresh(client_ids[start : start + batch_size])
 
-        self.orders = orders
+        job.finished = timezone.now()
+        job.save(update_fields=["finished"])
 
-    def save_order(self, order):
-        """ Saves cleaned order to the database. """
+    def file_hash(self, csv_path):
+        sha256 = hashlib.sha256()
+        with csv_path.open("rb") as csv_file:
+            for block in iter(lambda: csv_file.read(1024 * 1024), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
 
-        client, created = Client.objects.get_or_create(name=order.client, phone=order.phone)
+    def load_caches(self):
+        """Load existing clients, mounters, addresses and orders keys into dictionaries."""
+        self.clients = {}
+        self.clients_by_name = {}
+        for pk, name, phone in Client.objects.values_list("pk", "name", "phone").order_by("name"):
+            self.clients.setdefault((name, phone), pk)
+            self.clients_by_name.setdefault(name, pk)
 
-        if order.mounter:
-            try:
-                mounter = Mounter.objects.get(name__name=order.mounter)
-            except Mounter.DoesNotExist:
-                client_and_mounter, created = Client.objects.get_or_create(name=order.mounter)
-                mounter = Mounter.objects.create(name=client_and_mounter)
+        self.mounters = {}
+        for pk, name in Mounter.objects.values_list("pk", "name__name"):
+            self.mounters.setdefault(name, pk)
 
-        if order.address:
-            address, created = Address.objects.get_or_create(address_info=order.address)
+        self.addresses = {}
+        for pk, address_info in Address.objects.exclude(address_info="").values_list("pk", "address_info"):
+            self.addresses.setdefault(address_info, pk)
 
+        self.orders = {}
+        for pk, *key in Order.objects.values_list("pk", "date_created", "client", "provider_code"):
+            self.orders.setdefault(tuple(key), pk)
+
+    def read_order(self, line_number, line):
+        """Return cleaned order from the csv line, or None if the line is skipped."""
         try:
-            new_order = Order.objects.get(
-                date_created=order.date_created,
-                client=client,
-                provider_code=order.provider_code,
-            )
-        except Order.DoesNotExist:
-            price = Price.objects.create(
-                total=order.total_price, mounting=order.mounting_price
-            )
-            new_order = Order(
-                date_created=order.date_created,
-                client=client,
-                provider_code=order.provider_code,
-                price=price,
-                status=order.status,
-            )
-            if order.address:
-                new_order.address = address
-
-            if order.mounter:
-                new_order.mounter = mounter
-            new_order.save()
-        for transaction in order.transactions:
-            Transaction.objects.get_or_create(
-                amount=transaction[0], date=transaction[1], client=client, order=new_order
-            )
+            order = OrderData(*line)
+        except TypeError:
+            self.skipped.append((line_number, f"expected 16 columns, got {len(line)}", line))
+            return None
+
+        if not order.valid:
+            self.skipped.append((line_number, "invalid order", order))
+            return None
+
+        try:
+            order.clean()
+        except ValueError as error:
+            self.skipped.append((line_number, error, order))
+            return None
+
+        if not order.date_created:
+            self.skipped.append((line_number, "order has no date", order))
+            return None
+
+        return order
+
+    @transaction.atomic
+    def save_batch(self, orders, job, last_line):
+        """Save orders with bulk inserts and remember `last_line` in the import `job`.
+
+        Related objects missing in caches are created first.
+        """
+        job.last_line = last_line
+        job.save(update_fields=["last_line"])
+        if not orders:
+            return
+
+        new_clients = []
+        new_mounters = []
+        new_addresses = []
+        for order in orders:
+            if (order.client, order.phone) not in self.clients:
+                client = Client(name=order.client, phone=order.phone)
+                new_clients.append(client)
+                self.clients[(order.client, order.phone)] = client.pk
+                self.clients_by_name.setdefault(order.client, client.pk)
+
+            if order.mounter and order.mounter not in self.mounters:
+                if order.mounter not in self.clients_by_name:
+                    client = Client(name=order.mounter)
+                    new_clients.append(client)
+                    self.clients[(order.mounter, "")] = client.pk
+                    self.clients_by_name[order.mounter] = client.pk
+                mounter = Mounter(name_id=self.clients_by_name[order.mounter])
+                new_mounters.append(mounter)
+                self.mounters[order.mounter] = mounter.pk
+
+            if order.address and order.address not in self.addresses:
+                address = Address(address_info=order.address)
+                new_addresses.append(address)
+                self.addresses[order.address] = address.pk
+
+        Client.objects.bulk_create(new_clients)
+        Mounter.objects.bulk_create(new_mounters)
+        Address.objects.bulk_create(new_addresses)
+
+        new_prices = []
+        new_orders = []
+        order_ids = []
+        for order in orders:
+            client_id = self.clients[(order.client, order.phone)]
+            key = (to_datetime(order.date_created), client_id, order.provider_code)
+            if key not in self.orders:
+                price = Price(total=order.total_price, mounting=order.mounting_price)
+                new_prices.append(price)
+                new_order = Order(
+                    date_created=key[0],
+                    client_id=client_id,
+                    provider_code=order.provider_code,
+                    price=price,
+                    status=order.status,
+                    address_id=self.addresses.get(order.address),
+                    mounter_id=self.mounters.get(order.mounter),
+                )
+                new_orders.append(new_order)
+                self.orders[key] = new_order.pk
+            order_ids.append(self.orders[key])
+
+        Price.objects.bulk_create(new_prices)
+        Order.objects.bulk_create(new_orders)
+
+        existing_transactions = set(
+            Transaction.objects.filter(order__in=set(order_ids)).values_list("amount", "date", "client", "order")
+        )
+        new_transactions = []
+        for order, order_id in zip(orders, order_ids):
+            client_id = self.clients[(order.client, order.phone)]
+            for amount, date in order.transactions:
+                key = (amount, to_datetime(date), client_id, order_id)
+                if key not in existing_transactions:
+                    existing_transactions.add(key)
+                    new_transactions.append(
+                        Transaction(amount=amount, date=key[1], client_id=client_id, order_id=order_id)
+                    )
+
+        Transaction.objects.bulk_create(new_transactions)
+        ChangeLog.objects.log(Order, [new_order.pk for new_order in new_orders], ChangeLog.Action.CREATED)
+        ChangeLog.objects.log(
+            Transaction, [new_transaction.pk for new_transaction in new_transactions], ChangeLog.Action.CREATED
+        )
+
+        self.client_ids.update(self.clients[(order.client, order.phone)] for order in orders)
+        CashboxCheckpoint.objects.invalidate(*[new_transaction.date for new_transaction in new_transactions])
+        self.imported += len(orders)
+        self.created_orders += len(new_orders)
+        self.created_transactions += len(new_transactions)
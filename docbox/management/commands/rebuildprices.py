@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from docbox.models import Price
+
+
+class Command(BaseCommand):
+    help = "Rebuild and verify stored provider cost and profit of all prices"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Only report prices with outdated provider cost or profit, don't change them.",
+        )
+
+    def handle(self, *args, **options):
+        drifted_count = Price.objects.drifted().count()
+        self.stdout.write(f"Prices with outdated provider cost or profit: {drifted_count}")
+
+        if options["check"]:
+            if drifted_count:
+                raise CommandError("Stored provider cost or profit doesn't match provider orders.")
+            return
+
+        with transaction.atomic():
+            updated_count = Price.objects.all().update_provider_cost()
+            drifted_count = Price.objects.drifted().count()
+
+        if drifted_count:
+            raise CommandError(f"{drifted_count} prices still don't match provider orders after rebuild.")
+
+        self.stdout.write(f"Provider cost and profit rebuilt for {updated_count} prices.")
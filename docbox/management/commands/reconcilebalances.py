@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from docbox.models import Client, ClientBalance
+
+
+class Command(BaseCommand):
+    help = "Compare stored client balances with orders and transactions, fix them with --fix"
+    chunk_size = 1000
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fix", action="store_true", help="Save recalculated balances for drifted clients.")
+
+    def handle(self, *args, **options):
+        drifted_ids = []
+        refreshed_activity = 0
+        client_ids = list(Client.objects.order_by("pk").values_list("pk", flat=True))
+        for start in range(0, len(client_ids), self.chunk_size):
+            chunk_drifted_ids, chunk_refreshed_activity = self.find_drifted(client_ids[start : start + self.chunk_size])
+            drifted_ids += chunk_drifted_ids
+            refreshed_activity += chunk_refreshed_activity
+
+        self.stdout.write(
+            f"Checked {len(client_ids)} clients, drifted balances: {len(drifted_ids)}, "
+            f"refreshed last activity: {refreshed_activity}"
+        )
+        if not drifted_ids:
+            return
+
+        if not options["fix"]:
+            raise CommandError("Client balances don't match orders and transactions.")
+
+        for start in range(0, len(drifted_ids), self.chunk_size):
+            ClientBalance.objects.refresh(drifted_ids[start : start + self.chunk_size])
+        self.stdout.write(f"Fixed {len(drifted_ids)} client balances.")
+
+    def find_drifted(self, client_ids):
+        """Return ids of clients whose stored sums drifted and number of refreshed last activity dates.
+
+        Clients without orders and payments may have no stored balance, it's the same as a zero balance.
+        `last_activity` isn't moved back when the last order or payment is deleted, so it's refreshed
+        here without counting the balance as drifted.
+        """
+        stored = {balance.client_id: balance for balance in ClientBalance.objects.filter(client__in=client_ids)}
+        drifted_ids = []
+        stale_activity = []
+        for balance in ClientBalance.objects.calculate(Client.objects.filter(pk__in=client_ids)):
+            stored_balance = stored.get(balance.client_id) or ClientBalance(client_id=balance.client_id)
+            if self.balance_amounts(stored_balance) != self.balance_amounts(balance):
+                drifted_ids.append(balance.client_id)
+                self.stdout.write(f"Client {balance.client}: stored {stored_balance}, actual {balance}")
+            elif balance.client_id in stored and stored_balance.last_activity != balance.last_activity:
+                stored_balance.last_activity = balance.last_activity
+                stale_activity.append(stored_balance)
+
+        ClientBalance.objects.bulk_update(stale_activity, ["last_activity"])
+        return drifted_ids, len(stale_activity)
+
+    def balance_amounts(self, balance):
+        return (balance.orders_total, balance.paid_total, balance.remaining)
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from docbox.models import CashboxCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Restore data backup made by backuporders from the local directory. "
+        "Delta backup is restored with all previous backups up to the full one, "
+        "objects are merged with existing by their primary keys, objects deleted before a delta are deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("manifest", help="Path to the backup manifest json file.")
+
+    def handle(self, *args, **options):
+        directory = os.path.dirname(os.path.abspath(options["manifest"]))
+        manifests = self.read_chain(options["manifest"])
+
+        paths = []
+        for manifest in manifests:
+            path = os.path.join(directory, manifest["file"])
+            if not os.path.exists(path):
+                raise CommandError(f"Backup file {path} doesn't exist.")
+            if self.sha256(path) != manifest["sha256"]:
+                raise CommandError(f"Checksum of {path} doesn't match the manifest.")
+            paths.append(path)
+
+        with transaction.atomic():
+            for manifest, path in zip(manifests, paths):
+                self.stdout.write(f"Loading {os.path.basename(path)}")
+                call_command("loaddata", path, stdout=self.stdout)
+                self.delete_objects(manifest.get("deleted", {}))
+
+            # Signals don't run for loaded objects, so stored aggregates are updated here.
+            CashboxCheckpoint.objects.all().delete()
+            call_command("reconcilebalances", "--fix", stdout=self.stdout)
+
+    def delete_objects(self, deleted):
+        """Delete objects which were deleted before the delta backup was made."""
+        for label, object_ids in deleted.items():
+            _, counts = apps.get_model(label).objects.filter(pk__in=object_ids).delete()
+            self.stdout.write(f"Deleted {label}: {counts.get(label, 0)}")
+
+    def read_chain(self, manifest_path):
+        """Return manifests from the full backup to the given one."""
+        directory = os.path.dirname(manifest_path)
+        manifests = []
+        while manifest_path:
+            try:
+                with open(manifest_path) as manifest_file:
+                    manifest = json.load(manifest_file)
+            except FileNotFoundError:
+                raise CommandError(f"Backup manifest {manifest_path} doesn't exist.")
+            manifests.insert(0, manifest)
+
+            manifest_path = None
+            if manifest["previous"]:
+                manifest_path = os.path.join(directory, f"{manifest['previous']}.json")
+        return manifests
+
+    def sha256(self, path):
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as backup_file:
+            for block in iter(lambda: backup_file.read(1024 * 1024), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
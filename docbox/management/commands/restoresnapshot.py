@@ -0,0 +1,61 @@
+import gzip
+import json
+import os
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from ._snapshot import ChecksumFile
+
+
+class Command(BaseCommand):
+    help = "Replace all docbox tables with the snapshot made by the snapshot command"
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Directory with the snapshot files.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Snapshots can be restored only to PostgreSQL database.")
+
+        directory = options["directory"]
+        try:
+            with open(os.path.join(directory, "manifest.json")) as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            raise CommandError(f"There is no snapshot manifest in {directory}.")
+
+        tables = manifest["tables"]
+        models = [apps.get_model(table["model"]) for table in tables]
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Tables with pending deferred foreign key checks can't be truncated,
+            # tables are copied in dependency order, so checks can be immediate.
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            table_names = ", ".join(f'"{table["table"]}"' for table in tables)
+            cursor.execute(f"TRUNCATE {table_names}")
+            for table in tables:
+                self.copy_table(cursor, table, directory)
+
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+        self.stdout.write(f"Snapshot from {manifest['created']} restored.")
+
+    def copy_table(self, cursor, table, directory):
+        started = time.monotonic()
+        with gzip.open(os.path.join(directory, table["file"]), "rb") as table_file:
+            checksum_file = ChecksumFile(table_file)
+            cursor.copy_expert(f'COPY "{table["table"]}" ({table["columns"]}) FROM STDIN', checksum_file)
+
+        # Raising error rolls back the whole restore.
+        if checksum_file.hexdigest() != table["sha256"]:
+            raise CommandError(f"Checksum of {table['file']} doesn't match the manifest.")
+
+        self.stdout.write(
+            f"{table['table']}: {checksum_file.rows} rows, {checksum_file.size} bytes, "
+            f"{time.monotonic() - started:.2f} seconds"
+        )
@@ -0,0 +1,114 @@
+import time
+from datetime import timedelta
+
+import requests
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from docbox import botclient
+from docbox.models import DeliveryNotification, ProviderOrder
+
+# Claimed notifications aren't taken by other workers until the lease expires.
+LEASE = timedelta(minutes=5)
+RETRY_DELAY = timedelta(seconds=30)
+MAX_RETRY_DELAY = timedelta(hours=1)
+
+
+def retry_delay(attempts):
+    """Return exponential backoff delay after the failed attempt number `attempts`."""
+    return min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+class Command(BaseCommand):
+    help = "Send queued delivery notifications to the telegram bot"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Send pending notifications and exit.")
+        parser.add_argument("--queue", action="store_true", help="Show queue depth and exit.")
+        parser.add_argument("--interval", type=float, default=10, help="Seconds between checks of the empty queue.")
+        parser.add_argument("--batch-size", type=int, default=100, help="Max number of notifications in one pass.")
+
+    def handle(self, *args, **options):
+        if options["queue"]:
+            self.write_queue_depth()
+            return
+
+        with requests.Session() as session:
+            while True:
+                processed = self.send_pending(session, options["batch_size"])
+                if processed:
+                    self.write_queue_depth()
+                if options["once"]:
+                    break
+                if not processed:
+                    time.sleep(options["interval"])
+
+    def write_queue_depth(self):
+        depth = DeliveryNotification.objects.queue_depth()
+        oldest = timezone.localtime(depth["oldest"]).isoformat() if depth["oldest"] else "-"
+        self.stdout.write(f"Queued: {depth['queued']}, failed: {depth['failed']}, oldest: {oldest}")
+
+    def claim(self, batch_size):
+        """Lease pending notifications to this worker, so the messages are sent outside of the transaction."""
+        now = timezone.now()
+        with transaction.atomic():
+            notifications = list(
+                DeliveryNotification.objects.pending(now)
+                .select_for_update(skip_locked=True, of=("self",))
+                .select_related("provider_order")[:batch_size]
+            )
+            DeliveryNotification.objects.filter(pk__in=[notification.pk for notification in notifications]).update(
+                next_attempt=now + LEASE
+            )
+        return notifications
+
+    def send_pending(self, session, batch_size):
+        """Send one message per delivery date for the claimed notifications, return number of processed ones."""
+        notifications = self.claim(batch_size)
+
+        # The delivery date may be changed again before the notification is sent,
+        # notifications about the old date are dropped, the new date has its own notification.
+        actual = {}
+        outdated = []
+        for notification in notifications:
+            if notification.provider_order.delivery_date != notification.delivery_date:
+                outdated.append(notification.pk)
+            else:
+                actual.setdefault(notification.provider_order_id, []).append(notification)
+
+        # The date may also change after the claim, such rows are left to the notification about the new date.
+        rows = []
+        for row in ProviderOrder.objects.filter(pk__in=list(actual)).delivery_rows():
+            if row["delivery_date"] == actual[row["pk"]][0].delivery_date:
+                rows.append(row)
+            else:
+                outdated += [notification.pk for notification in actual.pop(row["pk"])]
+        if outdated:
+            DeliveryNotification.objects.filter(pk__in=outdated).update(
+                sent=timezone.now(), error="Дата доставки изменилась"
+            )
+
+        for delivery_date, date_rows in botclient.group_orders_by_delivery_date(rows).items():
+            date_notifications = [notification for row in date_rows for notification in actual[row["pk"]]]
+            self.send(session, delivery_date, date_rows, date_notifications)
+
+        return len(notifications)
+
+    def send(self, session, delivery_date, rows, notifications):
+        """Send delivery rows of one date, each provider order is mentioned once for all its notifications."""
+        queryset = DeliveryNotification.objects.filter(pk__in=[notification.pk for notification in notifications])
+        try:
+            for message in botclient.create_delivery_messages({delivery_date: rows}):
+                botclient.send_message_to_bot(session, message)
+        except requests.RequestException as error:
+            attempts = max(notification.attempts for notification in notifications) + 1
+            queryset.update(
+                attempts=F("attempts") + 1, next_attempt=timezone.now() + retry_delay(attempts), error=str(error)
+            )
+            self.stderr.write(f"Delivery {delivery_date}: {len(rows)} orders not sent, {error}")
+            return
+
+        queryset.update(attempts=F("attempts") + 1, sent=timezone.now(), error="")
+        self.stdout.write(f"Delivery {delivery_date}: {len(rows)} orders sent")
@@ -0,0 +1,60 @@
+import gzip
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from ._snapshot import ChecksumFile, copy_columns, get_models
+
+
+class Command(BaseCommand):
+    help = "Dump all docbox tables with PostgreSQL COPY into compressed files, restore them with restoresnapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument("directory", help="Directory for the snapshot files, it's created if it doesn't exist.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("Snapshots can be made only from PostgreSQL database.")
+
+        directory = options["directory"]
+        os.makedirs(directory, exist_ok=True)
+        manifest = {"created": timezone.now().isoformat(), "tables": []}
+
+        # All tables are copied in one repeatable read transaction, so the snapshot is consistent.
+        # Isolation level can be set only at the start of the outermost transaction.
+        outermost = not connection.in_atomic_block
+        with transaction.atomic(), connection.cursor() as cursor:
+            if outermost:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            for model in get_models():
+                manifest["tables"].append(self.copy_table(cursor, model, directory))
+
+        with open(os.path.join(directory, "manifest.json"), "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+    def copy_table(self, cursor, model, directory):
+        started = time.monotonic()
+        table = model._meta.db_table
+        filename = f"{table}.copy.gz"
+
+        with gzip.open(os.path.join(directory, filename), "wb") as table_file:
+            checksum_file = ChecksumFile(table_file)
+            columns = copy_columns(model)
+            cursor.copy_expert(f'COPY "{table}" ({columns}) TO STDOUT', checksum_file)
+
+        self.stdout.write(
+            f"{table}: {checksum_file.rows} rows, {checksum_file.size} bytes, "
+            f"{time.monotonic() - started:.2f} seconds"
+        )
+        return {
+            "table": table,
+            "model": model._meta.label,
+            "columns": columns,
+            "file": filename,
+            "rows": checksum_file.rows,
+            "sha256": checksum_file.hexdigest(),
+        }
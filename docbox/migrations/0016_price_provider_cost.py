@@ -0,0 +1,57 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:07
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_provider_cost(apps, schema_editor):
+    Price = apps.get_model("docbox", "Price")
+    ProviderOrder = apps.get_model("docbox", "ProviderOrder")
+
+    decimal_field = models.DecimalField(max_digits=10, decimal_places=0)
+    provider_orders = (
+        ProviderOrder.objects.filter(order__price=models.OuterRef("pk"))
+        .order_by()
+        .values("order__price")
+        .annotate(total=models.Sum("price"))
+        .values("total")
+    )
+    Price.objects.update(
+        provider_cost=Coalesce(models.Subquery(provider_orders, output_field=decimal_field), models.Value(0))
+    )
+
+    no_expenses = models.Q(provider_cost=0) & (models.Q(added_expenses__isnull=True) | models.Q(added_expenses=0))
+    Price.objects.update(
+        profit=models.Case(
+            models.When(no_expenses, then=models.Value(0)),
+            default=(
+                models.F("total")
+                - Coalesce("mounting", models.Value(0), output_field=decimal_field)
+                - Coalesce("delivery", models.Value(0), output_field=decimal_field)
+                - models.F("provider_cost")
+                - Coalesce("added_expenses", models.Value(0), output_field=decimal_field)
+            ),
+            output_field=decimal_field,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0015_alter_order_date_created'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='price',
+            name='provider_cost',
+            field=models.DecimalField(decimal_places=0, default=0, editable=False, max_digits=10, verbose_name='Цена поставщика'),
+        ),
+        migrations.AddField(
+            model_name='price',
+            name='profit',
+            field=models.DecimalField(decimal_places=0, default=0, editable=False, max_digits=10, verbose_name='Прибыль'),
+        ),
+        migrations.RunPython(fill_provider_cost, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_balances(apps, schema_editor):
+    """Calculate balances of existing clients, later they are kept up to date by signals."""
+    client_model = apps.get_model("docbox", "Client")
+    order_model = apps.get_model("docbox", "Order")
+    transaction_model = apps.get_model("docbox", "Transaction")
+    balance_model = apps.get_model("docbox", "ClientBalance")
+
+    orders = {
+        row["client"]: row
+        for row in order_model.objects.order_by()
+        .values("client")
+        .annotate(total=models.Sum("price__total"), last_date=models.Max("date_created"))
+    }
+    payments = {
+        row["client"]: row
+        for row in transaction_model.objects.exclude(client=None)
+        .order_by()
+        .values("client")
+        .annotate(total=models.Sum("amount"), last_date=models.Max("date"))
+    }
+
+    balances = []
+    existing = set(balance_model.objects.values_list("client", flat=True))
+    for client_id in client_model.objects.exclude(pk__in=existing).values_list("pk", flat=True).iterator():
+        client_orders = orders.get(client_id, {})
+        client_payments = payments.get(client_id, {})
+        orders_total = client_orders.get("total") or 0
+        paid_total = client_payments.get("total") or 0
+        dates = [date for date in (client_orders.get("last_date"), client_payments.get("last_date")) if date]
+        balances.append(
+            balance_model(
+                client_id=client_id,
+                orders_total=orders_total,
+                paid_total=paid_total,
+                remaining=orders_total - paid_total,
+                last_activity=max(dates, default=None),
+            )
+        )
+    balance_model.objects.bulk_create(balances, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0016_price_provider_cost'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientBalance',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='docbox.client', verbose_name='Клиент')),
+                ('orders_total', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Сумма заказов')),
+                ('paid_total', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Оплачено')),
+                ('remaining', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='Остаток')),
+                ('last_activity', models.DateTimeField(blank=True, null=True, verbose_name='Последняя активность')),
+            ],
+            options={
+                'verbose_name': 'Баланс клиента',
+                'verbose_name_plural': 'Балансы клиентов',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='clientbalance',
+            index=models.Index(fields=['-remaining'], name='docbox_balance_remaining_idx'),
+        ),
+        migrations.RunPython(fill_balances, migrations.RunPython.noop),
+    ]
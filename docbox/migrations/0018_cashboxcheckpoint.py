@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0017_clientbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CashboxCheckpoint',
+            fields=[
+                ('date', models.DateField(primary_key=True, serialize=False, verbose_name='Дата')),
+                ('balance', models.DecimalField(decimal_places=0, max_digits=12, verbose_name='Остаток в кассе на конец дня')),
+            ],
+            options={
+                'verbose_name': 'Остаток в кассе',
+                'verbose_name_plural': 'Остатки в кассе',
+                'ordering': ['-date'],
+            },
+        ),
+    ]
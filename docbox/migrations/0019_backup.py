@@ -0,0 +1,46 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:21
+
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0018_cashboxcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Backup',
+            fields=[
+                ('backup_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='Название')),
+                ('kind', models.SlugField(choices=[('full', 'полный'), ('delta', 'изменения')], verbose_name='Тип')),
+                ('since', models.DateTimeField(blank=True, null=True, verbose_name='Изменения с')),
+                ('until', models.DateTimeField(verbose_name='Изменения по')),
+                ('manifest', models.JSONField(default=dict, verbose_name='Манифест')),
+            ],
+            options={
+                'verbose_name': 'Резервная копия',
+                'verbose_name_plural': 'Резервные копии',
+                'ordering': ['-until'],
+            },
+        ),
+        migrations.AddField(
+            model_name='price',
+            name='date_changed',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True, verbose_name='Изменен'),
+        ),
+        migrations.AddField(
+            model_name='providerorder',
+            name='date_changed',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True, verbose_name='Изменен'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='date_changed',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True, verbose_name='Изменен'),
+        ),
+    ]
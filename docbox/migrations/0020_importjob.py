@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:45
+
+import uuid
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0019_backup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('import_job_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('file_name', models.CharField(max_length=255, verbose_name='Файл')),
+                ('file_hash', models.CharField(max_length=64, unique=True, verbose_name='SHA-256 файла')),
+                ('last_line', models.PositiveIntegerField(default=0, verbose_name='Последняя сохраненная строка')),
+                ('started', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Начат')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Завершен')),
+            ],
+            options={
+                'verbose_name': 'Импорт заказов',
+                'verbose_name_plural': 'Импорты заказов',
+                'ordering': ['-started'],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:51
+
+import uuid
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0020_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryNotification',
+            fields=[
+                ('notification_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('delivery_date', models.DateField(verbose_name='Дата доставки')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Создано')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Попыток отправки')),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('sent', models.DateTimeField(blank=True, null=True, verbose_name='Отправлено')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('provider_order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='docbox.providerorder', verbose_name='Заказ поставщика')),
+            ],
+            options={
+                'verbose_name': 'Уведомление о доставке',
+                'verbose_name_plural': 'Уведомления о доставке',
+                'ordering': ['created'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='deliverynotification',
+            index=models.Index(condition=models.Q(('sent__isnull', True)), fields=['next_attempt'], name='docbox_notification_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0021_deliverynotification'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='providerorder',
+            index=models.Index(fields=['-creation_date', '-provider_order_id'], name='docbox_po_keyset_idx'),
+        ),
+    ]
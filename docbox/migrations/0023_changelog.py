@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 11:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0022_providerorder_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('change_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(choices=[('order', 'order'), ('providerorder', 'providerorder'), ('transaction', 'transaction')], max_length=16, verbose_name='Модель')),
+                ('object_id', models.UUIDField(verbose_name='Id объекта')),
+                ('action', models.SlugField(choices=[('created', 'создан'), ('updated', 'изменен'), ('deleted', 'удален')], verbose_name='Действие')),
+                ('changed', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Изменен')),
+            ],
+            options={
+                'verbose_name': 'Изменение',
+                'verbose_name_plural': 'Журнал изменений',
+                'ordering': ['change_id'],
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:05
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Columns of the search vector of each table, the vectors are updated by triggers on PostgreSQL.
+SEARCH_COLUMNS = {
+    "docbox_client": ["name", "phone", "info"],
+    "docbox_address": ["town", "street", "building", "address_info"],
+    "docbox_order": ["comment"],
+    "docbox_transaction": ["comment"],
+    "docbox_providerorder": ["order_content"],
+}
+
+
+def create_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    for table, columns in SEARCH_COLUMNS.items():
+        columns_list = ", ".join(columns)
+        schema_editor.execute(
+            f"CREATE TRIGGER {table}_search_vector_update BEFORE INSERT OR UPDATE OF {columns_list} ON {table} "
+            "FOR EACH ROW EXECUTE PROCEDURE "
+            f"tsvector_update_trigger(search_vector, 'pg_catalog.russian', {columns_list})"
+        )
+        # Fires the trigger for existing rows.
+        schema_editor.execute(f"UPDATE {table} SET {columns[0]} = {columns[0]}")
+        schema_editor.execute(f"CREATE INDEX {table}_search_idx ON {table} USING gin (search_vector)")
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    for table in SEARCH_COLUMNS:
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_search_vector_update ON {table}")
+        schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0024_provider_code_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='client',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='providerorder',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+    ]
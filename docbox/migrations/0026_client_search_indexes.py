@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+# Postgres only indexes for the clients search, they aren't a part of the models state.
+# Prefix search by lower(name) needs pattern ops, phone fragments are found with pg_trgm if it's installed.
+NAME_INDEX = "docbox_client_name_lower_idx"
+PHONE_INDEX = "docbox_client_phone_trgm_idx"
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {NAME_INDEX} ON docbox_client (lower(name) text_pattern_ops)")
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        if cursor.fetchone()[0]:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {PHONE_INDEX} ON docbox_client USING gin (phone gin_trgm_ops)")
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP INDEX IF EXISTS {NAME_INDEX}")
+        cursor.execute(f"DROP INDEX IF EXISTS {PHONE_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0025_search_vectors'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['name', 'client_id'], name='docbox_client_keyset_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0026_client_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['cashbox', 'date'], name='docbox_transaction_cashbox_idx'),
+        ),
+    ]
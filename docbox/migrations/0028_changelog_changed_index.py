@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('docbox', '0027_transaction_cashbox_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['changed'], name='docbox_changelog_changed_idx'),
+        ),
+    ]
@@ -1,25 +1,534 @@
+from datetime import datetime, time, timedelta
 from decimal import ROUND_HALF_UP
+from functools import lru_cache
 from uuid import uuid4
 
-from django.db import models
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVectorField,
+    TrigramSimilarity,
+)
+from django.db import connection, connections, models, transaction
+from django.db.models.functions import Cast, Coalesce, Concat, Greatest, Lower, TruncDate
 from django.urls import reverse
 from django.utils import timezone
 
 from docbox.validators import validate_phone
 
 
+def sum_subquery(queryset, group_by, field):
+    """Return correlated subquery with SUM of `field` over `queryset` grouped by `group_by`.
+
+    Empty groups are coalesced to zero so the result can be used in arithmetic.
+    """
+    queryset = queryset.order_by().values(group_by).annotate(total=models.Sum(field)).values("total")
+    decimal_field = models.DecimalField(max_digits=12, decimal_places=0)
+    return Coalesce(models.Subquery(queryset, output_field=decimal_field), models.Value(0), output_field=decimal_field)
+
+
+def iterate_chunks(queryset, chunk_size):
+    """Iterate over `queryset` with a server side cursor and yield lists of up to `chunk_size` items."""
+    chunk = []
+    for item in queryset.iterator(chunk_size):
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def provider_orders_statuses(order_ids):
+    """Yield order id, order status and set of distinct statuses of its provider orders.
+
+    Postgres aggregates statuses with array_agg, other databases get distinct pairs and group them here.
+    Orders without provider orders are skipped.
+    """
+    provider_orders = ProviderOrder.objects.filter(order__in=order_ids).order_by()
+    if connection.vendor == "postgresql":
+        rows = provider_orders.values("order").annotate(
+            order_status=models.Max("order__status"),
+            statuses=ArrayAgg("status", distinct=True),
+        )
+        for row in rows.values_list("order", "order_status", "statuses"):
+            yield row[0], row[1], set(row[2])
+        return
+
+    statuses = {}
+    for order_id, order_status, status in provider_orders.values_list("order", "order__status", "status").distinct():
+        statuses.setdefault((order_id, order_status), set()).add(status)
+    for (order_id, order_status), order_statuses in statuses.items():
+        yield order_id, order_status, order_statuses
+
+
+@lru_cache(maxsize=None)
+def trigram_search_enabled(using="default"):
+    """Return True if pg_trgm extension is installed, migrations install it where it's available."""
+    if connections[using].vendor != "postgresql":
+        return False
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        return cursor.fetchone()[0]
+
+
+def provider_orders_codes(order_ids):
+    """Return dict of comma separated provider orders codes by order id, same as `Order.provider_orders_str`."""
+    codes = {}
+    provider_orders = ProviderOrder.objects.filter(order__in=list(order_ids)).values_list("order_id", "code")
+    for order_id, code in provider_orders:
+        codes.setdefault(order_id, []).append(code)
+    return {order_id: ", ".join(order_codes) for order_id, order_codes in codes.items()}
+
+
+class ClientQuerySet(models.QuerySet):
+    def with_financials(self, date_range=None):
+        """Annotate clients with money totals needed by the Client financial properties.
+
+        All totals are calculated with subqueries in the same sql statement,
+        so rendering a list of clients doesn't make queries per client.
+        If `date_range` is set, only orders created in this range are counted.
+        """
+        orders = Order.objects.filter(client=models.OuterRef("pk"))
+        transactions = Transaction.objects.filter(client=models.OuterRef("pk"))
+
+        if date_range:
+            orders = orders.filter(date_created__range=date_range)
+
+        return self.annotate(
+            orders_total=sum_subquery(orders, "client", "price__total"),
+            orders_mounting=sum_subquery(orders, "client", "price__mounting"),
+            orders_delivery=sum_subquery(orders, "client", "price__delivery"),
+            orders_added_expenses=sum_subquery(orders, "client", "price__added_expenses"),
+            provider_orders_total=sum_subquery(orders, "client", "price__provider_cost"),
+            transactions_total=sum_subquery(transactions, "client", "amount"),
+        )
+
+    def with_profit(self):
+        """Add sortable aliases for products price, expenses, profit and extra charge.
+
+        Should be called after `with_financials`, values are the same as in Client properties.
+        """
+        decimal_field = models.DecimalField(max_digits=12, decimal_places=0)
+        no_expenses = models.Q(expenses_total=0)
+        queryset = self.alias(
+            products_price_total=models.F("orders_total") - models.F("orders_mounting") - models.F("orders_delivery"),
+            expenses_total=models.F("provider_orders_total") + models.F("orders_added_expenses"),
+        )
+        queryset = queryset.alias(
+            profit_total=models.Case(
+                models.When(no_expenses, then=models.Value(0)),
+                default=models.F("products_price_total") - models.F("expenses_total"),
+                output_field=decimal_field,
+            ),
+        )
+        return queryset.alias(
+            extra_charge_total=models.Case(
+                models.When(no_expenses, then=models.Value(0.0)),
+                default=Cast("profit_total", models.FloatField()) * 100 / models.F("expenses_total"),
+                output_field=models.FloatField(),
+            ),
+        )
+
+    def search(self, query):
+        """Filter clients by the start of the name in any case or by a fragment of the phone number.
+
+        Query with digits and no letters is a phone fragment, so "067 12" finds "0671234567".
+        """
+        query = query.strip()
+        digits = "".join(char for char in query if char.isdigit())
+        if digits and not any(char.isalpha() for char in query):
+            return self.filter(phone__contains=digits)
+        return self.alias(name_lower=Lower("name")).filter(name_lower__startswith=query.lower())
+
+    def autocomplete_rows(self, query="", limit=20):
+        """Return up to `limit` clients found by `search` for typeaheads as dicts with `display` text."""
+        clients = self.search(query) if query else self
+        rows = clients.order_by("name").values("client_id", "name", "phone")[:limit]
+        return [dict(row, display=Client.display_name(row["name"], row["phone"])) for row in rows]
+
+    def keyset_page(self, after=None):
+        """Order clients by name and return ones after the `after` key.
+
+        `after` is a pair of name and id of the last client on the previous page.
+        """
+        queryset = self.order_by("name", "client_id")
+        if after:
+            name, client_id = after
+            queryset = queryset.filter(models.Q(name__gt=name) | models.Q(name=name, client_id__gt=client_id))
+        return queryset
+
+
+class PriceQuerySet(models.QuerySet):
+    def update_provider_cost(self):
+        """Recalculate stored provider cost and profit from the order provider orders."""
+        self.update(provider_cost=self._provider_cost_expression(), date_changed=timezone.now())
+        return self.update(profit=self._profit_expression("provider_cost"))
+
+    def drifted(self):
+        """Return prices with stored provider cost or profit not matching their provider orders."""
+        queryset = self.alias(actual_provider_cost=self._provider_cost_expression())
+        queryset = queryset.alias(actual_profit=self._profit_expression("actual_provider_cost"))
+        return queryset.exclude(
+            provider_cost=models.F("actual_provider_cost"),
+            profit=models.F("actual_profit"),
+        )
+
+    @staticmethod
+    def _provider_cost_expression():
+        provider_orders = ProviderOrder.objects.filter(order__price=models.OuterRef("pk"))
+        return sum_subquery(provider_orders, "order__price", "price")
+
+    @staticmethod
+    def _profit_expression(provider_cost):
+        """Return profit of the products over expenses, profit is 0 if there are no expenses.
+
+        `provider_cost` is the name of the field or alias with provider orders sum.
+        """
+        decimal_field = models.DecimalField(max_digits=10, decimal_places=0)
+        added_expenses = Coalesce("added_expenses", models.Value(0), output_field=decimal_field)
+        products = (
+            models.F("total")
+            - Coalesce("mounting", models.Value(0), output_field=decimal_field)
+            - Coalesce("delivery", models.Value(0), output_field=decimal_field)
+        )
+        no_expenses = models.Q(**{provider_cost: 0}) & (
+            models.Q(added_expenses__isnull=True) | models.Q(added_expenses=0)
+        )
+        return models.Case(
+            models.When(no_expenses, then=models.Value(0)),
+            default=products - models.F(provider_cost) - added_expenses,
+            output_field=decimal_field,
+        )
+
+
+class ProviderOrderQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """Update provider orders, recalculate provider cost of their orders prices and log the changes."""
+        kwargs.setdefault("date_changed", timezone.now())
+        provider_order_ids = list(self.values_list("pk", flat=True))
+        with transaction.atomic(using=self.db):
+            if "price" not in kwargs and "order" not in kwargs:
+                rows = super().update(**kwargs)
+            else:
+                price_ids = set(self.values_list("order__price", flat=True))
+                if "order" in kwargs:
+                    order_pk = getattr(kwargs["order"], "pk", kwargs["order"])
+                    price_ids.update(Order.objects.filter(pk=order_pk).values_list("price", flat=True))
+                rows = super().update(**kwargs)
+                Price.objects.filter(pk__in=price_ids).update_provider_cost()
+            ChangeLog.objects.log(ProviderOrder, provider_order_ids, ChangeLog.Action.UPDATED)
+        return rows
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        """Bulk update provider orders, recalculate provider cost of their orders prices and log the changes."""
+        now = timezone.now()
+        for provider_order in objs:
+            provider_order.date_changed = now
+        if "date_changed" not in fields:
+            fields = [*fields, "date_changed"]
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            # Bulk update of the base queryset calls its update, not the one above.
+            models.QuerySet(self.model, using=self.db).bulk_update(objs, fields, batch_size=batch_size)
+            if "price" in fields or "order" in fields:
+                order_ids = {provider_order.order_id for provider_order in objs}
+                Price.objects.filter(order__in=order_ids).update_provider_cost()
+            provider_order_ids = [provider_order.pk for provider_order in objs]
+            ChangeLog.objects.log(ProviderOrder, provider_order_ids, ChangeLog.Action.UPDATED)
+
+    def keyset_page(self, after=None):
+        """Order provider orders from newest to oldest and return ones after the `after` key.
+
+        `after` is a pair of creation date and id of the last provider order on the previous page.
+        """
+        queryset = self.order_by("-creation_date", "-provider_order_id")
+        if after:
+            creation_date, provider_order_id = after
+            queryset = queryset.filter(
+                models.Q(creation_date__lt=creation_date)
+                | models.Q(creation_date=creation_date, provider_order_id__lt=provider_order_id)
+            )
+        return queryset
+
+    def delivery_rows(self):
+        """Return provider orders values for delivery messages ordered by delivery date.
+
+        Client name and debt are joined in the same query, the debt is taken from the stored client balance.
+        """
+        decimal_field = models.DecimalField(max_digits=12, decimal_places=0)
+        return self.order_by("delivery_date", "code").values(
+            "pk",
+            "delivery_date",
+            "code",
+            "order_content",
+            client_name=models.F("order__client__name"),
+            client_remaining=Coalesce("order__client__balance__remaining", models.Value(0), output_field=decimal_field),
+        )
+
+
+class OrderQuerySet(models.QuerySet):
+    def with_balance(self):
+        """Annotate orders with paid sum, remaining sum and date of the last payment."""
+        transactions = Transaction.objects.filter(order=models.OuterRef("pk"))
+        last_payment = transactions.order_by("-date").values("date")[:1]
+        return self.annotate(
+            paid_sum=sum_subquery(transactions, "order", "amount"),
+            last_payment_date=models.Subquery(last_payment, output_field=models.DateTimeField()),
+        ).annotate(remaining=models.F("price__total") - models.F("paid_sum"))
+
+    def with_related(self):
+        """Load related objects shown in order lists, so rendering an order doesn't make queries."""
+        return self.select_related("client", "address", "mounter__name", "price").prefetch_related(
+            models.Prefetch("providerorder_set", queryset=ProviderOrder.objects.all())
+        )
+
+    def list_filter(self, start_date=None, end_date=None, status="all", category="all"):
+        """Filter orders by creation date range, status and category the way orders list does.
+
+        `status` can also be "not_finished" to exclude finished orders, "all" disables the filter.
+        """
+        queryset = self
+        if start_date and end_date:
+            queryset = queryset.filter(date_created__range=(start_date, end_date))
+
+        if category != "all":
+            queryset = queryset.filter(category=category)
+
+        if status == "not_finished":
+            return queryset.exclude(status="finished")
+
+        if status != "all":
+            queryset = queryset.filter(status=status)
+
+        return queryset
+
+    def csv_rows(self, chunk_size=2000):
+        """Yield rows with the same columns as `Order.data_for_csv`, see `backup_rows`."""
+        for row, bookkeeping_row in self.backup_rows(chunk_size):
+            yield row
+
+    def backup_rows(self, chunk_size=2000):
+        """Yield pairs of rows with `Order.data_for_csv` and `Order.bookkeeping_data_for_csv` columns.
+
+        Orders are read as values with a server side cursor, provider order codes
+        are loaded with one query per chunk, so memory use doesn't depend on the number of orders.
+        """
+        fields = [
+            "order_id",
+            "date_created",
+            "provider_code",
+            "status",
+            "client__name",
+            "client__phone",
+            "address__town",
+            "address__street_type",
+            "address__street",
+            "address__building",
+            "address__apartment",
+            "address__address_info",
+            "mounter__name__name",
+            "mounter__name__phone",
+            "price__total",
+            "price__mounting",
+            "price__delivery",
+            "price__added_expenses",
+            "price__provider_cost",
+            "price__profit",
+        ]
+        orders = self.prefetch_related(None).order_by("date_created", "pk").values(*fields)
+
+        statuses = dict(Order.Status.choices)
+        for chunk in iterate_chunks(orders, chunk_size):
+            codes = provider_orders_codes(order["order_id"] for order in chunk)
+            for order in chunk:
+                address = ""
+                if order["address__town"] is not None:
+                    address = Address(
+                        town=order["address__town"],
+                        street_type=order["address__street_type"],
+                        street=order["address__street"],
+                        building=order["address__building"],
+                        apartment=order["address__apartment"],
+                        address_info=order["address__address_info"],
+                    )
+                mounter = ""
+                if order["mounter__name__name"] is not None:
+                    mounter = Client(name=order["mounter__name__name"], phone=order["mounter__name__phone"])
+                price = Price(
+                    total=order["price__total"],
+                    mounting=order["price__mounting"],
+                    delivery=order["price__delivery"],
+                    added_expenses=order["price__added_expenses"],
+                    provider_cost=order["price__provider_cost"],
+                    profit=order["price__profit"],
+                )
+                mounting = price.mounting or 0
+                provider_orders_str = codes.get(order["order_id"], order["provider_code"])
+                status = statuses.get(order["status"], order["status"])
+
+                row = [
+                    order["date_created"],
+                    provider_orders_str,
+                    status,
+                    order["client__name"],
+                    address,
+                    order["client__phone"] or "",
+                    mounter,
+                    mounting,
+                    price.total - mounting,
+                ]
+                bookkeeping_row = [
+                    order["date_created"],
+                    provider_orders_str,
+                    order["client__name"],
+                    status,
+                    price.products,
+                    price.provider_orders_price,
+                    price.added_expenses or 0,
+                    price.profit,
+                    price.extra_charge,
+                ]
+                yield row, bookkeeping_row
+
+    def with_profit(self):
+        """Add aliases for order products price, expenses and profit, same as in Price properties."""
+        decimal_field = models.DecimalField(max_digits=12, decimal_places=0)
+        return self.alias(
+            products_price=(
+                models.F("price__total")
+                - Coalesce("price__mounting", models.Value(0))
+                - Coalesce("price__delivery", models.Value(0))
+            ),
+            expenses=(
+                models.F("price__provider_cost")
+                + Coalesce("price__added_expenses", models.Value(0), output_field=decimal_field)
+            ),
+            profit=models.F("price__profit"),
+        )
+
+    def bookkeeping_totals(self):
+        """Return products price, expenses and profit sums grouped by order status and category."""
+        decimal_field = models.DecimalField(max_digits=12, decimal_places=0)
+        return (
+            self.with_profit()
+            .prefetch_related(None)
+            .order_by()
+            .values("status", "category")
+            .annotate(
+                products_price_sum=models.Sum("products_price", output_field=decimal_field),
+                expenses_sum=models.Sum("expenses", output_field=decimal_field),
+                profit_sum=models.Sum("profit", output_field=decimal_field),
+            )
+        )
+
+    def search_provider_code(self, query, limit=None):
+        """Return distinct orders with provider order code or legacy provider code containing `query`.
+
+        With pg_trgm the search uses trigram indexes and orders are ranked by the best similarity of their codes,
+        otherwise they keep their ordering.
+        """
+        queryset = self.filter(self._provider_code_q(query))
+
+        if trigram_search_enabled(self.db):
+            similarity = (
+                ProviderOrder.objects.filter(order=models.OuterRef("pk"))
+                .annotate(similarity=TrigramSimilarity("code", query))
+                .order_by("-similarity")
+                .values("similarity")[:1]
+            )
+            float_field = models.FloatField()
+            queryset = queryset.annotate(
+                search_rank=Greatest(
+                    Coalesce(models.Subquery(similarity, output_field=float_field), models.Value(0.0)),
+                    Coalesce(TrigramSimilarity("provider_code", query), models.Value(0.0)),
+                    output_field=float_field,
+                )
+            ).order_by("-search_rank", "-date_created")
+
+        if limit:
+            queryset = queryset[:limit]
+        return queryset
+
+    def autocomplete_rows(self, query="", limit=20):
+        """Return up to `limit` newest orders for typeaheads as dicts with `display` text, order and client ids.
+
+        Orders are matched by a fragment of their codes or by the client search, values are projected,
+        so orders don't load their related objects.
+        """
+        queryset = self
+        if query:
+            queryset = queryset.filter(self._provider_code_q(query) | models.Q(client__in=Client.objects.search(query)))
+        rows = list(
+            queryset.with_balance()
+            .order_by("-date_created")
+            .values("order_id", "provider_code", "client_id", "client__name", "remaining")[:limit]
+        )
+        codes = provider_orders_codes(row["order_id"] for row in rows)
+        return [
+            {
+                "display": (
+                    f"{codes.get(row['order_id']) or row['provider_code'] or ''} - {row['client__name']} "
+                    f"(остаток: {row['remaining']} грн.)"
+                ),
+                "order_id": row["order_id"],
+                "client_id": row["client_id"],
+                "client_name": row["client__name"],
+            }
+            for row in rows
+        ]
+
+    @staticmethod
+    def _provider_code_q(query):
+        provider_orders = ProviderOrder.objects.filter(code__contains=query)
+        return models.Q(pk__in=provider_orders.values("order")) | models.Q(provider_code__contains=query)
+
+    def update_status_from_provider_orders(self):
+        """Set status of orders whose provider orders all have the same status to that status.
+
+        Does the same as update_status signal, but for many orders with one select and one update,
+        only orders whose status actually changes are updated.
+        """
+        changed = {}
+        for order_id, status, provider_statuses in provider_orders_statuses(self.values("pk")):
+            if len(provider_statuses) == 1 and status not in provider_statuses:
+                changed[order_id] = provider_statuses.pop()
+        if not changed:
+            return 0
+
+        new_status = models.Case(
+            *[models.When(pk=order_id, then=models.Value(status)) for order_id, status in changed.items()],
+            output_field=models.SlugField(),
+        )
+        with transaction.atomic(using=self.db, savepoint=False):
+            rows = Order.objects.filter(pk__in=changed).update(status=new_status, date_changed=timezone.localdate())
+            ChangeLog.objects.log(Order, changed, ChangeLog.Action.UPDATED)
+        return rows
+
+
 class Client(models.Model):
 
     client_id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     name = models.CharField(verbose_name="Имя", max_length=64)
     phone = models.CharField(verbose_name="Телефон", blank=True, max_length=10, validators=[validate_phone])
     info = models.TextField(verbose_name="Заметка", max_length=1024, blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    # Fields of the search vector, it's updated by the database trigger.
+    SEARCH_FIELDS = ["name", "phone", "info"]
+
+    objects = ClientQuerySet.as_manager()
 
     def __str__(self):
-        phone = ""
-        if self.phone:
-            phone = f" ({self.phone[:3]}) {self.phone[3:6]} {self.phone[6:]}"
-        return self.name + phone
+        return self.display_name(self.name, self.phone)
+
+    @staticmethod
+    def display_name(name, phone):
+        """Return name with formatted phone, so values of clients can be shown like clients."""
+        if phone:
+            return f"{name} ({phone[:3]}) {phone[3:6]} {phone[6:]}"
+        return name
 
     @property
     def transactions(self):
@@ -27,7 +536,7 @@ class Client(models.Model):
 
     @property
     def last_orders(self):
-        return self.client_orders.order_by("-date_created")[:15]
+        return self.client_orders.with_balance().with_related().order_by("-date_created")[:15]
 
     @property
     def last_transactions(self):
@@ -35,22 +544,33 @@ class Client(models.Model):
 
     @property
     def transactions_sum(self):
+        if hasattr(self, "transactions_total"):
+            return self.transactions_total
         if self.transactions:
             return self.transactions.aggregate(models.Sum("amount"))["amount__sum"]
         return 0
 
     @property
     def orders_sum(self):
+        if hasattr(self, "orders_total"):
+            return self.orders_total
         if self.client_orders:
             return self.client_orders.aggregate(models.Sum("price__total"))["price__total__sum"]
         return 0
 
     @property
     def remaining(self):
+        if not hasattr(self, "orders_total"):
+            balance = getattr(self, "balance", None)
+            if balance:
+                return balance.remaining
         return self.orders_sum - self.transactions_sum
 
     @property
     def products_price(self):
+        if hasattr(self, "orders_total"):
+            return self.orders_total - self.orders_mounting - self.orders_delivery
+
         orders_price = self.client_orders.aggregate(sum=models.Sum("price__total"))["sum"]
         mounting_price = self.client_orders.aggregate(sum=models.Sum("price__mounting"))["sum"]
         delivery_price = self.client_orders.aggregate(sum=models.Sum("price__delivery"))["sum"]
@@ -62,10 +582,14 @@ class Client(models.Model):
 
     @property
     def provider_orders_price(self):
+        if hasattr(self, "provider_orders_total"):
+            return self.provider_orders_total
         return self.client_orders.aggregate(sum=models.Sum("providerorder__price"))["sum"] or 0
 
     @property
     def orders_added_expenses_sum(self):
+        if hasattr(self, "orders_added_expenses"):
+            return self.orders_added_expenses
         return self.client_orders.aggregate(sum=models.Sum("price__added_expenses"))["sum"] or 0
 
     @property
@@ -99,6 +623,89 @@ class Client(models.Model):
         verbose_name_plural = "Клиенты"
         ordering = ["name"]
         unique_together = ["name", "phone"]
+        indexes = [models.Index(fields=["name", "client_id"], name="docbox_client_keyset_idx")]
+
+
+class ClientBalanceQuerySet(models.QuerySet):
+    def debtors(self):
+        """Return balances of clients who still owe money, biggest debts first."""
+        return self.filter(remaining__gt=0).order_by("-remaining")
+
+    def calculate(self, clients):
+        """Return list of unsaved ClientBalance instances calculated for `clients` queryset."""
+        last_order = Order.objects.filter(client=models.OuterRef("pk")).order_by("-date_created")
+        last_payment = Transaction.objects.filter(client=models.OuterRef("pk")).order_by("-date")
+        clients = clients.with_financials().annotate(
+            last_order_date=models.Subquery(last_order.values("date_created")[:1]),
+            last_payment_date=models.Subquery(last_payment.values("date")[:1]),
+        )
+
+        balances = []
+        for client in clients.order_by():
+            activity_dates = [date for date in (client.last_order_date, client.last_payment_date) if date]
+            balances.append(
+                ClientBalance(
+                    client=client,
+                    orders_total=client.orders_sum,
+                    paid_total=client.transactions_sum,
+                    remaining=client.remaining,
+                    last_activity=max(activity_dates, default=None),
+                )
+            )
+        return balances
+
+    def add(self, client_id, orders_total=0, paid_total=0, activity=None):
+        """Add orders and payments sums deltas to the client balance with one update, without recalculating it.
+
+        `last_activity` only moves forward, reconcilebalances moves it back after deletes.
+        Returns False if the client has no balance yet.
+        """
+        updates = {}
+        if orders_total:
+            updates["orders_total"] = models.F("orders_total") + orders_total
+        if paid_total:
+            updates["paid_total"] = models.F("paid_total") + paid_total
+        if orders_total or paid_total:
+            updates["remaining"] = models.F("remaining") + (orders_total - paid_total)
+        if activity:
+            activity = models.Value(activity, output_field=models.DateTimeField())
+            # Greatest is NULL on SQLite if one of the values is NULL.
+            updates["last_activity"] = Coalesce(Greatest("last_activity", activity), activity)
+
+        balances = self.filter(client=client_id)
+        if not updates:
+            return balances.exists()
+        return balances.update(**updates) > 0
+
+    def refresh(self, client_ids):
+        """Recalculate and save balances of clients with `client_ids`."""
+        balances = self.calculate(Client.objects.filter(pk__in=client_ids))
+
+        # Replacing rows is much faster than bulk_update, which builds a CASE expression per row.
+        with transaction.atomic(using=self.db):
+            self.filter(client__in=client_ids).delete()
+            self.bulk_create(balances)
+        return balances
+
+
+class ClientBalance(models.Model):
+    client = models.OneToOneField(
+        "Client", verbose_name="Клиент", primary_key=True, related_name="balance", on_delete=models.CASCADE
+    )
+    orders_total = models.DecimalField(verbose_name="Сумма заказов", max_digits=12, decimal_places=0, default=0)
+    paid_total = models.DecimalField(verbose_name="Оплачено", max_digits=12, decimal_places=0, default=0)
+    remaining = models.DecimalField(verbose_name="Остаток", max_digits=12, decimal_places=0, default=0)
+    last_activity = models.DateTimeField(verbose_name="Последняя активность", blank=True, null=True)
+
+    objects = ClientBalanceQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Баланс клиента"
+        verbose_name_plural = "Балансы клиентов"
+        indexes = [models.Index(fields=["-remaining"], name="docbox_balance_remaining_idx")]
+
+    def __str__(self):
+        return f"{self.remaining} грн."
 
 
 class Mounter(models.Model):
@@ -115,11 +722,20 @@ class Mounter(models.Model):
         return str(self.name)
 
 
+class ProviderQuerySet(models.QuerySet):
+    def autocomplete_rows(self, query="", limit=20):
+        """Return up to `limit` providers with `query` in the name for typeaheads as dicts with `display` text."""
+        rows = self.filter(name__icontains=query).order_by("name").values("provider_id", "name")[:limit]
+        return [dict(row, display=row["name"]) for row in rows]
+
+
 class Provider(models.Model):
 
     provider_id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     name = models.CharField(verbose_name="Название", max_length=64)
 
+    objects = ProviderQuerySet.as_manager()
+
     def get_absolute_url(self):
         return reverse("docbox:provider-detail", kwargs={"pk": self.pk})
 
@@ -159,6 +775,9 @@ class Address(models.Model):
     building = models.CharField(verbose_name="Дом", max_length=8, blank=True)
     apartment = models.PositiveIntegerField(verbose_name="Квартира", blank=True, null=True)
     address_info = models.TextField(verbose_name="Заметка", max_length=1024, blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    SEARCH_FIELDS = ["town", "street", "building", "address_info"]
 
     def __str__(self):
         address = self.town
@@ -190,6 +809,23 @@ class Price(models.Model):
     )
     delivery = models.DecimalField(verbose_name="Доставка", max_digits=10, decimal_places=0, blank=True, null=True)
     mounting = models.DecimalField(verbose_name="Монтаж", max_digits=10, decimal_places=0, blank=True, null=True)
+    provider_cost = models.DecimalField(
+        verbose_name="Цена поставщика", max_digits=10, decimal_places=0, default=0, editable=False
+    )
+    profit = models.DecimalField(verbose_name="Прибыль", max_digits=10, decimal_places=0, default=0, editable=False)
+    date_changed = models.DateTimeField(verbose_name="Изменен", auto_now=True, null=True, db_index=True)
+
+    objects = PriceQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        """Save price and recalculate stored provider cost and profit."""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.update_provider_cost()
+
+    def update_provider_cost(self):
+        Price.objects.filter(pk=self.pk).update_provider_cost()
+        self.refresh_from_db(fields=["provider_cost", "profit"])
 
     @property
     def products(self):
@@ -204,22 +840,13 @@ class Price(models.Model):
 
     @property
     def provider_orders_price(self):
-        provider_orders = self.order.providerorder_set
-        if provider_orders.count() == 0:
-            return 0
-        return provider_orders.aggregate(models.Sum("price"))["price__sum"]
-
-    @property
-    def profit(self):
-        if self.expenses:
-            return self.products - self.expenses
-        return 0
+        return self.provider_cost
 
     @property
     def expenses(self):
         if self.added_expenses:
-            return self.provider_orders_price + self.added_expenses
-        return self.provider_orders_price
+            return self.provider_cost + self.added_expenses
+        return self.provider_cost
 
     @property
     def extra_charge(self):
@@ -236,6 +863,39 @@ class Price(models.Model):
         return f"{str(self.total)} грн."
 
 
+class TransactionQuerySet(models.QuerySet):
+    def csv_rows(self, chunk_size=2000):
+        """Yield rows with the same columns as `Transaction.data_for_csv`, reading transactions in chunks."""
+        fields = [
+            "cashbox",
+            "date",
+            "amount",
+            "client__name",
+            "provider__name",
+            "order_id",
+            "order__provider_code",
+            "comment",
+        ]
+        transactions = self.order_by("date", "pk").values(*fields)
+
+        for chunk in iterate_chunks(transactions, chunk_size):
+            codes = provider_orders_codes({item["order_id"] for item in chunk if item["order_id"]})
+            for item in chunk:
+                order = ""
+                if item["order_id"]:
+                    order = codes.get(item["order_id"], item["order__provider_code"])
+
+                yield [
+                    "да" if item["cashbox"] else "нет",
+                    item["date"],
+                    item["amount"],
+                    item["client__name"] or "",
+                    item["provider__name"] or "",
+                    order,
+                    item["comment"],
+                ]
+
+
 class Transaction(models.Model):
     transaction_id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     amount = models.DecimalField(verbose_name="Сумма", max_digits=10, decimal_places=0)
@@ -245,6 +905,19 @@ class Transaction(models.Model):
     comment = models.TextField(verbose_name="Комментарий", max_length=1024, blank=True)
     order = models.ForeignKey("Order", verbose_name="Заказ", on_delete=models.PROTECT, blank=True, null=True)
     cashbox = models.BooleanField(verbose_name="Касса", null=True, default=True)
+    date_changed = models.DateTimeField(verbose_name="Изменен", auto_now=True, null=True, db_index=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    SEARCH_FIELDS = ["comment"]
+
+    objects = TransactionQuerySet.as_manager()
+
+    CSV_HEADER = ["Касса", "Дата", "Сумма", "Клиент", "Поставщик", "Заказ", "Комментарий"]
+
+    def save(self, *args, **kwargs):
+        """Save transaction in the same transaction with post_save update of the client balance."""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.amount} грн."
@@ -275,6 +948,96 @@ class Transaction(models.Model):
         verbose_name = "Транзакция"
         verbose_name_plural = "Транзакции"
         ordering = ["-date"]
+        indexes = [models.Index(fields=["cashbox", "date"], name="docbox_transaction_cashbox_idx")]
+
+
+def end_of_day(day):
+    """Return aware datetime of the start of the next day after `day`."""
+    return timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+class CashboxCheckpointQuerySet(models.QuerySet):
+    def balance(self, day=None):
+        """Return cashbox balance at the end of the `day`, or the current balance if `day` isn't set.
+
+        Balance is taken from the last checkpoint before the day,
+        so only transactions after the checkpoint are summed.
+        Checkpoints missing up to yesterday are created first, so it doesn't depend on cashboxcheckpoints runs.
+        """
+        yesterday = timezone.localdate() - timedelta(days=1)
+        checkpoint = self.order_by("-date").first()
+        if not checkpoint or checkpoint.date < yesterday:
+            self.create_checkpoints(until=yesterday)
+            checkpoint = self.order_by("-date").first()
+
+        transactions = Transaction.objects.filter(cashbox=True)
+        if day:
+            transactions = transactions.filter(date__lt=end_of_day(day))
+            if checkpoint and checkpoint.date > day:
+                checkpoint = self.filter(date__lte=day).order_by("-date").first()
+
+        balance = 0
+        if checkpoint:
+            balance = checkpoint.balance
+            transactions = transactions.filter(date__gte=end_of_day(checkpoint.date))
+
+        total = Coalesce(models.Sum("amount"), models.Value(0), output_field=models.DecimalField())
+        return balance + transactions.aggregate(sum=total)["sum"]
+
+    def create_checkpoints(self, until):
+        """Create daily checkpoints after the last one up to and including the `until` day."""
+        transactions = Transaction.objects.filter(cashbox=True, date__lt=end_of_day(until))
+        last_checkpoint = self.order_by("-date").first()
+        balance = 0
+        if last_checkpoint:
+            balance = last_checkpoint.balance
+            transactions = transactions.filter(date__gte=end_of_day(last_checkpoint.date))
+            day = last_checkpoint.date + timedelta(days=1)
+        else:
+            first_transaction = transactions.order_by("date").first()
+            if not first_transaction:
+                return []
+            day = timezone.localdate(first_transaction.date)
+        if day > until:
+            return []
+
+        daily_sums = dict(
+            transactions.annotate(day=TruncDate("date"))
+            .order_by()
+            .values("day")
+            .annotate(sum=models.Sum("amount"))
+            .values_list("day", "sum")
+        )
+
+        checkpoints = []
+        while day <= until:
+            balance += daily_sums.get(day, 0)
+            checkpoints.append(CashboxCheckpoint(date=day, balance=balance))
+            day += timedelta(days=1)
+
+        # Checkpoints of the same days can be created by concurrent requests, they have the same balances.
+        return self.bulk_create(checkpoints, ignore_conflicts=True)
+
+    def invalidate(self, *dates):
+        """Delete checkpoints which include transactions made at any of the `dates`."""
+        dates = [date for date in dates if date]
+        if dates:
+            self.filter(date__gte=timezone.localdate(min(dates))).delete()
+
+
+class CashboxCheckpoint(models.Model):
+    date = models.DateField(verbose_name="Дата", primary_key=True)
+    balance = models.DecimalField(verbose_name="Остаток в кассе на конец дня", max_digits=12, decimal_places=0)
+
+    objects = CashboxCheckpointQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Остаток в кассе"
+        verbose_name_plural = "Остатки в кассе"
+        ordering = ["-date"]
+
+    def __str__(self):
+        return f"{self.date}: {self.balance} грн."
 
 
 class Order(models.Model):
@@ -295,6 +1058,29 @@ class Order(models.Model):
         ("steel_doors", "стальные двери"),
     ]
 
+    CSV_HEADER = [
+        "Дата создания",
+        "Номера заводских заказов",
+        "Статус",
+        "Клиент",
+        "Адрес",
+        "Телефон",
+        "Монтажник",
+        "Сумма монтажа",
+        "Цена без монтажа",
+    ]
+    BOOKKEEPING_CSV_HEADER = [
+        "Дата создания",
+        "Номера заводских заказов",
+        "Клиент",
+        "Статус",
+        "Цена изделий",
+        "Цена поставщика",
+        "Дополнительные расходы",
+        "Прибыль",
+        "Наценка",
+    ]
+
     order_id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     date_created = models.DateTimeField(verbose_name="Дата оформления", default=timezone.now, null=True)
     client = models.ForeignKey("Client", related_name="client_orders", verbose_name="Клиент", on_delete=models.PROTECT)
@@ -322,19 +1108,38 @@ class Order(models.Model):
     date_delivery = models.DateField(verbose_name="Дата доставки", blank=True, null=True)
     date_mounting = models.DateField(verbose_name="Дата монтажа", blank=True, null=True)
     date_finished = models.DateField(verbose_name="Дата закрытия заказа", blank=True, null=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    SEARCH_FIELDS = ["comment"]
+
+    objects = OrderQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        """Save order in the same transaction with post_save update of the client balance."""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     @property
     def remaining(self):
+        if hasattr(self, "_remaining"):
+            return self._remaining
         if self.transactions_sum:
             return self.price.total - self.transactions_sum
         return self.price.total
 
+    @remaining.setter
+    def remaining(self, value):
+        """Allows to set remaining value annotated by OrderQuerySet.with_balance."""
+        self._remaining = value
+
     @property
     def transactions(self):
         return self.transaction_set.all().order_by("date")
 
     @property
     def transactions_sum(self):
+        if hasattr(self, "paid_sum"):
+            return self.paid_sum
         if self.transactions:
             return self.transactions.aggregate(models.Sum("amount"))["amount__sum"]
         return 0
@@ -377,9 +1182,10 @@ class Order(models.Model):
 
     @property
     def provider_orders_str(self):
-        if self.providerorder_set.count() == 0:
+        provider_orders = self.provider_orders
+        if not provider_orders:
             return self.provider_code
-        return ", ".join([provider_order.code for provider_order in self.provider_orders])
+        return ", ".join([provider_order.code for provider_order in provider_orders])
 
     @property
     def deletable(self):
@@ -388,12 +1194,8 @@ class Order(models.Model):
         return True
 
     def get_provider_orders_statuses(self):
-        if not self.provider_orders:
-            return False
-        statuses = set()
-        for provider_order in self.provider_orders:
-            statuses.add(provider_order.status)
-        return statuses
+        statuses = {provider_order.status for provider_order in self.provider_orders}
+        return statuses or False
 
     def __str__(self):
         order = f"{self.client.name}"
@@ -425,6 +1227,17 @@ class ProviderOrder(models.Model):
     creation_date = models.DateTimeField(verbose_name="Дата добавления", default=timezone.now)
     delivery_date = models.DateField(verbose_name="Дата доставки", blank=True, null=True)
     status = models.SlugField(verbose_name="Статус", choices=Order.Status.choices, default="new", blank=True)
+    date_changed = models.DateTimeField(verbose_name="Изменен", auto_now=True, null=True, db_index=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    SEARCH_FIELDS = ["order_content"]
+
+    objects = ProviderOrderQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        """Save provider order in the same transaction with post_save updates of the order price."""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return self.code
@@ -436,3 +1249,274 @@ class ProviderOrder(models.Model):
         verbose_name = "Заказ поставщика"
         verbose_name_plural = "Заказы поставщика"
         ordering = ["-creation_date"]
+        indexes = [models.Index(fields=["-creation_date", "-provider_order_id"], name="docbox_po_keyset_idx")]
+
+
+class Backup(models.Model):
+    """Manifest of the uploaded data backup, full or with changes since the previous backup."""
+
+    class Kind(models.TextChoices):
+        FULL = "full", "полный"
+        DELTA = "delta", "изменения"
+
+    backup_id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    name = models.CharField(verbose_name="Название", max_length=64, unique=True)
+    kind = models.SlugField(verbose_name="Тип", choices=Kind.choices)
+    since = models.DateTimeField(verbose_name="Изменения с", null=True, blank=True)
+    until = models.DateTimeField(verbose_name="Изменения по")
+    manifest = models.JSONField(verbose_name="Манифест", default=dict)
+
+    class Meta:
+        verbose_name = "Резервная копия"
+        verbose_name_plural = "Резервные копии"
+        ordering = ["-until"]
+
+    def __str__(self):
+        return self.name
+
+
+class ImportJob(models.Model):
+    """Progress of the csv file import, the import is resumed after the last saved line."""
+
+    import_job_id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    file_name = models.CharField(verbose_name="Файл", max_length=255)
+    file_hash = models.CharField(verbose_name="SHA-256 файла", max_length=64, unique=True)
+    last_line = models.PositiveIntegerField(verbose_name="Последняя сохраненная строка", default=0)
+    started = models.DateTimeField(verbose_name="Начат", default=timezone.now)
+    finished = models.DateTimeField(verbose_name="Завершен", blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Импорт заказов"
+        verbose_name_plural = "Импорты заказов"
+        ordering = ["-started"]
+
+    def __str__(self):
+        return f"{self.file_name}: {self.last_line}"
+
+
+class DeliveryNotificationQuerySet(models.QuerySet):
+    def pending(self, now=None):
+        """Return notifications which should be sent now."""
+        return self.filter(
+            sent__isnull=True,
+            attempts__lt=DeliveryNotification.MAX_ATTEMPTS,
+            next_attempt__lte=now or timezone.now(),
+        )
+
+    def queue_depth(self):
+        """Return numbers of not sent notifications, failed are the ones which ran out of attempts."""
+        return self.filter(sent__isnull=True).aggregate(
+            queued=models.Count("pk", filter=models.Q(attempts__lt=DeliveryNotification.MAX_ATTEMPTS)),
+            failed=models.Count("pk", filter=models.Q(attempts__gte=DeliveryNotification.MAX_ATTEMPTS)),
+            oldest=models.Min("created", filter=models.Q(attempts__lt=DeliveryNotification.MAX_ATTEMPTS)),
+        )
+
+    def enqueue(self, provider_orders):
+        """Queue delivery notifications for provider orders with their current delivery date."""
+        return self.bulk_create(
+            [
+                DeliveryNotification(provider_order=provider_order, delivery_date=provider_order.delivery_date)
+                for provider_order in provider_orders
+            ]
+        )
+
+
+class DeliveryNotification(models.Model):
+    """Outbox of telegram delivery notifications, they are sent by the sendnotifications command."""
+
+    MAX_ATTEMPTS = 8
+
+    notification_id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
+    provider_order = models.ForeignKey(
+        "ProviderOrder", verbose_name="Заказ поставщика", on_delete=models.CASCADE, related_name="notifications"
+    )
+    delivery_date = models.DateField(verbose_name="Дата доставки")
+    created = models.DateTimeField(verbose_name="Создано", default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(verbose_name="Попыток отправки", default=0)
+    next_attempt = models.DateTimeField(verbose_name="Следующая попытка", default=timezone.now)
+    sent = models.DateTimeField(verbose_name="Отправлено", blank=True, null=True)
+    error = models.TextField(verbose_name="Ошибка", blank=True)
+
+    objects = DeliveryNotificationQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Уведомление о доставке"
+        verbose_name_plural = "Уведомления о доставке"
+        ordering = ["created"]
+        indexes = [
+            models.Index(
+                fields=["next_attempt"], name="docbox_notification_queue_idx", condition=models.Q(sent__isnull=True)
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.provider_order_id}: {self.delivery_date}"
+
+
+# Change ids are taken when rows are inserted, so a missing id may still be committed by an unfinished transaction.
+# Ids of rolled back transactions are never filled, gaps older than this are skipped.
+CHANGE_GAP_TIMEOUT = timedelta(minutes=1)
+MAX_CHANGE_ID = 2**63 - 1
+
+
+class ChangeLogQuerySet(models.QuerySet):
+    def log(self, model, object_ids, action):
+        """Append changes of `model` objects to the log in the current transaction."""
+        object_ids = list(object_ids)
+        if not object_ids:
+            return []
+
+        model_name = model._meta.model_name
+        return self.bulk_create(
+            [ChangeLog(model=model_name, object_id=object_id, action=action) for object_id in object_ids]
+        )
+
+    def visible(self, since):
+        """Return changes after the `since` change id up to the first recent gap in the ids.
+
+        A reader which listed changes after the gap would skip the missing one if it's committed later,
+        so changes after it wait until it's filled or `CHANGE_GAP_TIMEOUT` passes.
+        """
+        recent_gaps = (
+            ChangeLog.objects.using(self.db)
+            .filter(change_id__gt=since + 1, changed__gt=timezone.now() - CHANGE_GAP_TIMEOUT)
+            .filter(~models.Exists(ChangeLog.objects.filter(change_id=models.OuterRef("change_id") - 1)))
+            .order_by("change_id")
+            .values("change_id")[:1]
+        )
+        first_gap = Coalesce(
+            models.Subquery(recent_gaps), models.Value(MAX_CHANGE_ID), output_field=models.BigIntegerField()
+        )
+        return self.filter(change_id__gt=since, change_id__lt=first_gap)
+
+    def last_change_id(self):
+        return self.order_by("-change_id").values_list("change_id", flat=True).first() or 0
+
+
+class ChangeLog(models.Model):
+    """Append only log of created, updated and deleted orders, provider orders and transactions."""
+
+    class Action(models.TextChoices):
+        CREATED = "created", "создан"
+        UPDATED = "updated", "изменен"
+        DELETED = "deleted", "удален"
+
+    MODELS = {"order": Order, "providerorder": ProviderOrder, "transaction": Transaction}
+
+    change_id = models.BigAutoField(primary_key=True)
+    model = models.CharField(verbose_name="Модель", max_length=16, choices=[(name, name) for name in MODELS])
+    object_id = models.UUIDField(verbose_name="Id объекта")
+    action = models.SlugField(verbose_name="Действие", choices=Action.choices)
+    changed = models.DateTimeField(verbose_name="Изменен", default=timezone.now)
+
+    objects = ChangeLogQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Изменение"
+        verbose_name_plural = "Журнал изменений"
+        ordering = ["change_id"]
+        indexes = [models.Index(fields=["changed"], name="docbox_changelog_changed_idx")]
+
+    def __str__(self):
+        return f"{self.change_id}: {self.action} {self.model} {self.object_id}"
+
+
+SEARCH_CONFIG = "russian"
+SEARCH_URL_NAMES = {
+    "client": "docbox:client-detail",
+    "order": "docbox:order-detail",
+    "transaction": "docbox:edit-transaction",
+    "providerorder": "docbox:edit-provider-order",
+}
+
+
+class SearchVectors(models.Func):
+    """Concatenation of search vectors, missing ones are treated as empty."""
+
+    arg_joiner = " || "
+    template = "(%(expressions)s)"
+    output_field = SearchVectorField()
+
+    def __init__(self, *expressions):
+        empty = Cast(models.Value(""), SearchVectorField())
+        super().__init__(*[Coalesce(expression, empty) for expression in expressions])
+
+
+def search_queryset(queryset, query, documents):
+    """Filter `queryset` by the search `query` matching one of its `documents` and annotate the rank of the match.
+
+    `documents` are pairs of the lookup prefix and the model, whose search vector is used.
+    Each vector is matched on its own, so the GIN index of its table is used, and only found objects are ranked.
+    Without PostgreSQL each word of the query should be contained in one of SEARCH_FIELDS of the same model.
+    """
+    if connections[queryset.db].vendor != "postgresql":
+        match = models.Q()
+        for prefix, model in documents:
+            document_match = models.Q()
+            for word in query.split():
+                word_match = models.Q()
+                for field in model.SEARCH_FIELDS:
+                    word_match |= models.Q(**{f"{prefix}{field}__icontains": word})
+                document_match &= word_match
+            match |= document_match
+        return queryset.filter(match).annotate(rank=models.Value(0.0, output_field=models.FloatField()))
+
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+    vectors = [models.F(f"{prefix}search_vector") for prefix, model in documents]
+    if len(vectors) == 1:
+        queryset = queryset.filter(search_vector=search_query)
+        return queryset.annotate(rank=SearchRank(vectors[0], search_query))
+
+    # Separate selects joined with UNION, an OR of matches in joined tables can't use their indexes.
+    matches = [
+        queryset.model.objects.filter(**{f"{prefix}search_vector": search_query}).order_by().values("pk")
+        for prefix, model in documents
+    ]
+    queryset = queryset.filter(pk__in=matches[0].union(*matches[1:]))
+    return queryset.annotate(rank=SearchRank(SearchVectors(*vectors), search_query))
+
+
+def full_text_search(query, limit=50):
+    """Return ranked clients, orders, transactions and provider orders matching `query`, all in one query.
+
+    Orders are matched by their comment, address or client, the whole query should match one of them.
+    Results are dicts with kind, object_id, title, detail, result_date, rank and url of the object.
+    """
+    no_date = models.Value(None, output_field=models.DateTimeField())
+    amount = Concat(Cast("amount", models.CharField()), models.Value(" грн."), output_field=models.CharField())
+    parts = [
+        ("client", Client.objects.all(), [("", Client)], models.F("name"), models.F("info"), no_date),
+        (
+            "order",
+            Order.objects.all(),
+            [("", Order), ("address__", Address), ("client__", Client)],
+            models.F("client__name"),
+            models.F("comment"),
+            models.F("date_created"),
+        ),
+        ("transaction", Transaction.objects.all(), [("", Transaction)], amount, models.F("comment"), models.F("date")),
+        (
+            "providerorder",
+            ProviderOrder.objects.all(),
+            [("", ProviderOrder)],
+            models.F("code"),
+            models.F("order_content"),
+            models.F("creation_date"),
+        ),
+    ]
+
+    querysets = []
+    for kind, queryset, documents, title, detail, result_date in parts:
+        queryset = search_queryset(queryset, query, documents).annotate(
+            kind=models.Value(kind, output_field=models.CharField()),
+            object_id=models.F("pk"),
+            title=title,
+            detail=detail,
+            result_date=result_date,
+        )
+        querysets.append(queryset.order_by().values("kind", "object_id", "title", "detail", "result_date", "rank"))
+
+    results = list(querysets[0].union(*querysets[1:], all=True).order_by("-rank", "-result_date")[:limit])
+    for result in results:
+        result["url"] = reverse(SEARCH_URL_NAMES[result["kind"]], kwargs={"pk": result["object_id"]})
+    return results
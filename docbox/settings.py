@@ -147,3 +147,7 @@ LOGGING = {
 
 TELEGRAM_SEND_MESSAGE_URL = os.getenv("TELEGRAM_SEND_MESSAGE_URL")
 TELEGRAM_ZAOKNOM_CHAT_ID = os.getenv("TELEGRAM_ZAOKNOM_CHAT_ID")
+
+# Where backuporders command stores backups: "gdrive" or "local" directory BACKUP_DIR.
+BACKUP_STORAGE = os.getenv("BACKUP_STORAGE", "gdrive")
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(BASE_DIR, "backups"))
@@ -0,0 +1,77 @@
+from decimal import Decimal
+
+from django.apps import apps
+
+# Sum the saved model adds to the client balance and the balance field it's added to.
+BALANCE_AMOUNTS = {
+    "order": ("price__total", "orders_total"),
+    "transaction": ("amount", "paid_total"),
+}
+
+
+def stored_balance_amount(sender, pk):
+    """Return client id and the sum the stored order or transaction adds to the client balance."""
+    amount, _ = BALANCE_AMOUNTS[sender._meta.model_name]
+    return sender.objects.filter(pk=pk).values_list("client", amount).first()
+
+
+def store_previous_balance_amount(sender, **kwargs):
+    """Remember client and sum of the order or transaction before it's saved or deleted, both can be changed."""
+    instance = kwargs["instance"]
+    if instance._state.adding or kwargs.get("raw"):
+        return
+    instance._previous_balance_amount = stored_balance_amount(sender, instance.pk)
+
+
+def update_client_balance(sender, **kwargs):
+    """Add the difference of the saved or deleted order or transaction sum to the client balances."""
+    if kwargs.get("raw"):
+        return
+    instance = kwargs["instance"]
+    balance_model = apps.get_model("docbox", "ClientBalance")
+    _, field = BALANCE_AMOUNTS[sender._meta.model_name]
+
+    deltas = {}
+    previous = instance.__dict__.pop("_previous_balance_amount", None)
+    if previous and previous[0]:
+        client_id, amount = previous
+        deltas[client_id] = -(amount or 0)
+
+    deleted = "created" not in kwargs
+    if not deleted:
+        if sender._meta.model_name == "order":
+            client_id, amount = stored_balance_amount(sender, instance.pk)
+            activity = instance.date_created
+        else:
+            client_id, amount, activity = instance.client_id, Decimal(str(instance.amount)), instance.date
+        if client_id:
+            deltas[client_id] = deltas.get(client_id, 0) + (amount or 0)
+
+    for client_id, delta in deltas.items():
+        if deleted or client_id != instance.client_id:
+            balance_model.objects.add(client_id, **{field: delta})
+        elif not balance_model.objects.add(client_id, activity=activity, **{field: delta}):
+            balance_model.objects.refresh([client_id])
+
+
+def store_previous_total(sender, **kwargs):
+    instance = kwargs["instance"]
+    if instance._state.adding or kwargs.get("raw"):
+        return
+    instance._previous_total = sender.objects.filter(pk=instance.pk).values_list("total", flat=True).first()
+
+
+def update_order_client_balance(sender, **kwargs):
+    if kwargs.get("raw"):
+        return
+    price = kwargs["instance"]
+    previous_total = price.__dict__.pop("_previous_total", None)
+    if previous_total is None:
+        return
+    delta = Decimal(str(price.total)) - previous_total
+    if not delta:
+        return
+    order_model = apps.get_model("docbox", "Order")
+    balance_model = apps.get_model("docbox", "ClientBalance")
+    for client_id in order_model.objects.filter(price=price.pk).values_list("client", flat=True):
+        balance_model.objects.add(client_id, orders_total=delta)
@@ -0,0 +1,17 @@
+from django.apps import apps
+
+
+def store_previous_date(sender, **kwargs):
+    """Remember date of the saved transaction, checkpoints after the old date are outdated too."""
+    instance = kwargs["instance"]
+    if instance._state.adding or kwargs.get("raw"):
+        return
+    instance._previous_date = sender.objects.filter(pk=instance.pk).values_list("date", flat=True).first()
+
+
+def invalidate_checkpoints(sender, **kwargs):
+    if kwargs.get("raw"):
+        return
+    instance = kwargs["instance"]
+    checkpoint_model = apps.get_model("docbox", "CashboxCheckpoint")
+    checkpoint_model.objects.invalidate(instance.date, getattr(instance, "_previous_date", None))
@@ -0,0 +1,15 @@
+from django.apps import apps
+
+
+def log_save(sender, **kwargs):
+    # Loaded fixtures and restored backups aren't changes.
+    if kwargs.get("raw"):
+        return
+    change_log_model = apps.get_model("docbox", "ChangeLog")
+    action = change_log_model.Action.CREATED if kwargs["created"] else change_log_model.Action.UPDATED
+    change_log_model.objects.log(sender, [kwargs["instance"].pk], action)
+
+
+def log_delete(sender, **kwargs):
+    change_log_model = apps.get_model("docbox", "ChangeLog")
+    change_log_model.objects.log(sender, [kwargs["instance"].pk], change_log_model.Action.DELETED)
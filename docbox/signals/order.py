@@ -1,9 +1,34 @@
+from functools import partial
+
+from django.apps import apps
+from django.db import transaction
+
+
+def update_pending_statuses(using):
+    """Recalculate statuses of orders whose provider orders were saved in the committed transaction."""
+    connection = transaction.get_connection(using)
+    order_ids, connection.docbox_pending_statuses = connection.docbox_pending_statuses, set()
+    if order_ids:
+        order_model = apps.get_model("docbox", "Order")
+        order_model.objects.using(using).filter(pk__in=order_ids).update_status_from_provider_orders()
+
+
 def update_status(sender, **kwargs):
-    provider_order = kwargs["instance"]
-    order = provider_order.order
+    """Mark the provider order's order for status recalculation when the transaction is committed.
 
-    provider_statues = order.get_provider_orders_statuses()
+    Orders changed in one transaction are recalculated together, with a fixed number of queries.
+    """
+    # Fixtures and restored backups already have the order status.
+    if kwargs.get("raw"):
+        return
+    provider_order = kwargs["instance"]
+    using = kwargs["using"]
 
-    if len(provider_statues) == 1:
-        order.status = provider_statues.pop()
-        order.save()
+    # Every save registers the callback, so it survives a rolled back savepoint. The first callback
+    # recalculates all pending orders and the rest find the set empty. Ids left from a rolled back
+    # transaction are recalculated with the next commit, which doesn't change their statuses.
+    connection = transaction.get_connection(using)
+    if not hasattr(connection, "docbox_pending_statuses"):
+        connection.docbox_pending_statuses = set()
+    connection.docbox_pending_statuses.add(provider_order.order_id)
+    transaction.on_commit(partial(update_pending_statuses, using), using=using)
@@ -0,0 +1,18 @@
+from django.apps import apps
+
+
+def store_previous_order(sender, **kwargs):
+    """Remember order of the saved provider order, it can be moved to another one."""
+    instance = kwargs["instance"]
+    if instance._state.adding or kwargs.get("raw"):
+        return
+    instance._previous_order_id = sender.objects.filter(pk=instance.pk).values_list("order", flat=True).first()
+
+
+def update_provider_cost(sender, **kwargs):
+    if kwargs.get("raw"):
+        return
+    provider_order = kwargs["instance"]
+    order_ids = {provider_order.order_id, getattr(provider_order, "_previous_order_id", None)} - {None}
+    price_model = apps.get_model("docbox", "Price")
+    price_model.objects.filter(order__in=order_ids).update_provider_cost()
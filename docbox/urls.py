@@ -30,10 +30,14 @@ docbox_patterns = (
         path("order/<uuid:pk>/edit", views.EditOrder.as_view(), name="order-edit"),
         path("order/<uuid:pk>/delete", views.DeleteOrder.as_view(), name="delete-order"),
         path("order/new", views.NewOrder.as_view(), name="new-order"),
+        path("search", views.Search.as_view(), name="search"),
         path("transactions", views.TransactionList.as_view(), name="transactions-list"),
         path("transaction/new", views.NewTransaction.as_view(), name="new-transaction"),
         path("transaction/<uuid:pk>/edit", views.EditTransaction.as_view(), name="edit-transaction"),
         path("transaction/<uuid:pk>/delete", views.DeleteTransaction.as_view(), name="delete-transaction"),
+        path("autocomplete/clients", views.AutocompleteClients.as_view(), name="autocomplete-clients"),
+        path("autocomplete/orders", views.AutocompleteOrders.as_view(), name="autocomplete-orders"),
+        path("autocomplete/providers", views.AutocompleteProviders.as_view(), name="autocomplete-providers"),
     ],
     "docbox",
 )
@@ -41,10 +45,13 @@ docbox_patterns = (
 docbox_api_patterns = (
     [
         path("balance", api_views.GetBalance.as_view(), name="get-balance"),
+        path("changes", api_views.ChangesFeed.as_view(), name="changes"),
+        path("notifications/queue", api_views.GetNotificationsQueue.as_view(), name="notifications-queue"),
         path("provider-order/list", api_views.ListProviderOrders.as_view(), name="list-provider-orders"),
         path(
             "provider-order/bulk-update", api_views.BulkUpdateProviderOrder.as_view(), name="bulk-update-provider-order"
         ),
+        path("search", api_views.Search.as_view(), name="search"),
         path("search-order", api_views.SearchOrder.as_view(), name="search-order"),
     ],
     "docbox-api",
@@ -1,18 +1,26 @@
 import json
 import os
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal, InvalidOperation
+from uuid import UUID
 
-from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
 from django.http import HttpResponseBadRequest, JsonResponse
 from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from django.views.generic import View
 
 from docbox import botclient
-from docbox.models import Order, ProviderOrder, Transaction
+from docbox.models import (
+    CashboxCheckpoint,
+    ChangeLog,
+    DeliveryNotification,
+    Order,
+    ProviderOrder,
+    full_text_search,
+)
+from docbox.views.cursor import decode_cursor, encode_cursor
 
 
 class ApiBaseView(View):
@@ -42,25 +50,170 @@ class ApiBaseView(View):
 
 class GetBalance(ApiBaseView):
     def get(self, request, *args, **kwargs):
-        cashbox_sum = Transaction.objects.filter(cashbox=True).aggregate(models.Sum("amount"))
-        return JsonResponse({"balance": cashbox_sum.get("amount__sum", 0)})
+        balance_date = request.GET.get("date")
+        if not balance_date:
+            return JsonResponse({"balance": CashboxCheckpoint.objects.balance()})
+
+        try:
+            balance_date = date.fromisoformat(balance_date)
+        except ValueError:
+            return self.return_errors("Date expected to be in iso format like 'YYYY-MM-DD'")
+
+        balance = CashboxCheckpoint.objects.balance(balance_date)
+        return JsonResponse({"balance": balance, "date": balance_date})
+
+
+class GetNotificationsQueue(ApiBaseView):
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(DeliveryNotification.objects.queue_depth())
 
 
 class ListProviderOrders(ApiBaseView):
+    """Provider orders from newest to oldest, paginated with the `cursor` returned as `next_cursor`."""
+
+    default_limit = 50
+    max_limit = 500
+    # Response field and the value it is taken from.
+    fields = {
+        "id": "provider_order_id",
+        "provider": "provider__name",
+        "code": "code",
+        "price": "price",
+        "status": "status",
+        "creation_date": "creation_date",
+        "delivery_date": "delivery_date",
+    }
+
     def get(self, request, *args, **kwargs):
-        data = {"provider_order_list": []}
-        for provider_order in ProviderOrder.objects.all()[:50]:
-            data["provider_order_list"].append(
+        try:
+            fields = self.get_fields(request.GET.get("fields"))
+            limit = self.get_limit(request.GET.get("limit"))
+            queryset = self.get_queryset(request.GET)
+        except ValueError as error:
+            return self.return_errors(str(error))
+
+        values = {"provider_order_id", "creation_date"} | {self.fields[field] for field in fields}
+        rows = list(queryset.values(*values)[: limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last["creation_date"].isoformat(), last["provider_order_id"])
+
+        data = {"provider_order_list": [], "next_cursor": next_cursor}
+        for row in rows[:limit]:
+            data["provider_order_list"].append({field: self.fields_value(row, field) for field in fields})
+        return JsonResponse(data)
+
+    def get_queryset(self, params):
+        queryset = ProviderOrder.objects.keyset_page(self.get_cursor_key(params.get("cursor")))
+        if params.get("status"):
+            queryset = queryset.filter(status__in=params["status"].split(","))
+        if params.get("provider"):
+            queryset = queryset.filter(provider__name=params["provider"])
+        try:
+            if params.get("delivery_date_from"):
+                queryset = queryset.filter(delivery_date__gte=date.fromisoformat(params["delivery_date_from"]))
+            if params.get("delivery_date_to"):
+                queryset = queryset.filter(delivery_date__lte=date.fromisoformat(params["delivery_date_to"]))
+        except ValueError:
+            raise ValueError("Delivery date expected to be in iso format like 'YYYY-MM-DD'")
+        return queryset
+
+    def get_fields(self, fields):
+        if not fields:
+            return list(self.fields)
+        fields = fields.split(",")
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        return fields
+
+    def get_limit(self, limit):
+        if not limit:
+            return self.default_limit
+        if not limit.isdigit() or int(limit) == 0:
+            raise ValueError("Limit should be a positive integer")
+        return min(int(limit), self.max_limit)
+
+    def fields_value(self, row, field):
+        value = row[self.fields[field]]
+        if field in ["price", "status", "delivery_date"]:
+            return value or ""
+        return value
+
+    @staticmethod
+    def get_cursor_key(cursor):
+        if not cursor:
+            return None
+        try:
+            creation_date, provider_order_id = decode_cursor(cursor)
+            return datetime.fromisoformat(creation_date), UUID(provider_order_id)
+        except ValueError:
+            raise ValueError("Invalid cursor")
+
+
+def changes_etag(request, *args, **kwargs):
+    # The log is append only, so a page of changes after `since` only changes with the last visible change id.
+    since = request.GET.get("since", "0")
+    limit = request.GET.get("limit", str(ChangesFeed.default_limit))
+    last_change_id = ChangeLog.objects.visible(int(since) if since.isdigit() else 0).last_change_id()
+    return f"{since}-{limit}-{last_change_id}"
+
+
+class ChangesFeed(ApiBaseView):
+    """Changes of orders, provider orders and transactions after the `since` change id.
+
+    Changes after an id which may still be committed by an unfinished transaction are listed once it's finished.
+
+    Each object is listed once per page with its latest change and current data, deleted objects have no data.
+    Polls with If-None-Match of the previous response get 304 while nothing changed.
+    """
+
+    default_limit = 500
+    max_limit = 1000
+
+    @method_decorator(condition(etag_func=changes_etag))
+    def get(self, request, *args, **kwargs):
+        since = request.GET.get("since", "0")
+        limit = request.GET.get("limit", str(self.default_limit))
+        if not since.isdigit() or not limit.isdigit() or int(limit) == 0:
+            return self.return_errors("Parameters 'since' and 'limit' should be positive integers")
+        limit = min(int(limit), self.max_limit)
+
+        changes = list(ChangeLog.objects.visible(int(since))[:limit])
+        latest_changes = {}
+        for change in changes:
+            latest_changes.pop((change.model, change.object_id), None)
+            latest_changes[(change.model, change.object_id)] = change
+
+        objects = {}
+        for model_name, model in ChangeLog.MODELS.items():
+            object_ids = [
+                change.object_id
+                for change in latest_changes.values()
+                if change.model == model_name and change.action != ChangeLog.Action.DELETED
+            ]
+            if object_ids:
+                fields = [field.attname for field in model._meta.concrete_fields if field.name != "search_vector"]
+                for row in model.objects.filter(pk__in=object_ids).order_by().values(*fields):
+                    objects[(model_name, row[model._meta.pk.attname])] = row
+
+        data = {
+            "changes": [
                 {
-                    "id": provider_order.pk,
-                    "provider": provider_order.provider.name,
-                    "code": provider_order.code,
-                    "price": provider_order.price or "",
-                    "status": provider_order.status or "",
-                    "creation_date": provider_order.creation_date,
-                    "delivery_date": provider_order.delivery_date or "",
+                    "change_id": change.change_id,
+                    "model": change.model,
+                    "object_id": change.object_id,
+                    "action": change.action,
+                    "changed": change.changed,
+                    # Object changed on this page can be deleted by a change on the next one.
+                    "data": objects.get(key),
                 }
-            )
+                for key, change in latest_changes.items()
+            ],
+            "next_since": changes[-1].change_id if changes else int(since),
+            "has_more": len(changes) == limit,
+        }
         return JsonResponse(data)
 
 
@@ -71,19 +224,29 @@ class BulkUpdateProviderOrder(ApiBaseView):
         except json.JSONDecodeError:
             return self.return_errors("Data should be in a valid json format")
         six_month_ago = timezone.now() - timedelta(days=180)
-        provider_orders = ProviderOrder.objects.filter(creation_date__gt=six_month_ago)
+        provider_orders = ProviderOrder.objects.filter(creation_date__gt=six_month_ago, code__in=list(data))
+        provider_orders_by_code = {
+            provider_order.code: provider_order for provider_order in provider_orders.select_related("order__client")
+        }
         self.new_orders_on_delivery = []
+        self.changed_fields = set()
+        changed_provider_orders = []
         for provider_code, new_info in data.items():
-            try:
-                provider_order = provider_orders.get(code=provider_code)
-            except ObjectDoesNotExist:
+            provider_order = provider_orders_by_code.get(provider_code)
+            if provider_order is None:
                 self.error_messages.append(f"Provider code '{provider_code}' doesn't exist.")
                 continue
 
-            self.update_info(provider_order, new_info)
+            if self.update_info(provider_order, new_info):
+                changed_provider_orders.append(provider_order)
+
+        if changed_provider_orders:
+            ProviderOrder.objects.bulk_update(changed_provider_orders, fields=sorted(self.changed_fields))
+            order_ids = {provider_order.order_id for provider_order in changed_provider_orders}
+            Order.objects.filter(pk__in=order_ids).update_status_from_provider_orders()
 
         if self.new_orders_on_delivery:
-            botclient.send_delivery_info(self.new_orders_on_delivery)
+            botclient.queue_delivery_info(self.new_orders_on_delivery)
 
         if self.error_messages:
             return self.return_errors()
@@ -91,34 +254,43 @@ class BulkUpdateProviderOrder(ApiBaseView):
         return JsonResponse({"status": "ok"})
 
     def update_info(self, provider_order, new_info):
+        """Apply new info to the provider order without saving it, return True if it was changed."""
+        changed = False
         if "status" in new_info:
-            self.update_status(provider_order, new_info)
+            changed |= self.update_status(provider_order, new_info)
 
         if "delivery_date" in new_info:
-            self.update_delivery_date(provider_order, new_info)
+            changed |= self.update_delivery_date(provider_order, new_info)
 
         if "price" in new_info:
             self.check_price(provider_order, new_info)
 
+        return changed
+
     def update_status(self, provider_order, new_info):
         new_status = new_info.get("status")
         if new_status in Order.Status.values and new_status != provider_order.status:
             provider_order.status = new_status
-            provider_order.save()
-        else:
-            self.error_messages.append(f"Status '{new_status}' is not allowed")
+            self.changed_fields.add("status")
+            return True
+
+        self.error_messages.append(f"Status '{new_status}' is not allowed")
+        return False
 
     def update_delivery_date(self, provider_order, new_info):
         try:
             new_delivery_date = date.fromisoformat(new_info["delivery_date"])
         except (ValueError, TypeError):
             self.error_messages.append("Delivery date expected to be in iso format like 'YYYY-MM-DD'")
-            return None
+            return False
 
         if provider_order.delivery_date != new_delivery_date:
             provider_order.delivery_date = new_delivery_date
-            provider_order.save()
+            self.changed_fields.add("delivery_date")
             self.new_orders_on_delivery.append(provider_order)
+            return True
+
+        return False
 
     def check_price(self, provider_order, new_info):
         try:
@@ -134,7 +306,25 @@ class BulkUpdateProviderOrder(ApiBaseView):
             )
 
 
+class Search(ApiBaseView):
+    default_limit = 50
+    max_limit = 200
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get("q", "").strip()
+        if not query:
+            return self.return_errors("The search query parametr 'q' is not set")
+        limit = request.GET.get("limit", str(self.default_limit))
+        if not limit.isdigit() or int(limit) == 0:
+            return self.return_errors("Limit should be a positive integer")
+
+        search_results = full_text_search(query, limit=min(int(limit), self.max_limit))
+        return JsonResponse({"status": "ok", "search_results": search_results})
+
+
 class SearchOrder(ApiBaseView):
+    limit = 50
+
     def get(self, request, *args, **kwargs):
         provider_code = request.GET.get("provider_code")
         queryset = self.get_filtered_queryset(provider_code)
@@ -165,6 +355,4 @@ class SearchOrder(ApiBaseView):
             self.error_messages.append("The search query parametr 'provider_code' is not set")
             return False
 
-        query = models.Q(providerorder__code__contains=provider_code)
-        legacy_query = models.Q(provider_code__contains=provider_code)
-        return Order.objects.filter(query | legacy_query)
+        return Order.objects.with_balance().with_related().search_provider_code(provider_code, limit=self.limit)
@@ -0,0 +1,18 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+
+def encode_cursor(*values):
+    """Return opaque cursor of keyset pagination with the key `values` of the last item on the page."""
+    return urlsafe_b64encode(json.dumps([str(value) for value in values]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return list of key values as strings, raise ValueError if the cursor isn't valid."""
+    try:
+        values = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+        raise ValueError("Invalid cursor")
+    return values
@@ -2,17 +2,25 @@ import csv
 import logging
 import os
 from datetime import date, datetime, timedelta
+from itertools import chain
+from uuid import UUID
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q, Sum
-from django.db.models.query import Prefetch
-from django.http import HttpResponse, HttpResponseRedirect
+from django.db.models import Exists, OuterRef
+from django.http import (
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.http.response import HttpResponseNotFound
 from django.shortcuts import redirect
 from django.urls import resolve, reverse, reverse_lazy
 from django.utils import formats
+from django.utils.decorators import method_decorator
 from django.utils.timezone import make_aware
+from django.views.decorators.cache import cache_control
 from django.views.generic import (
     DeleteView,
     DetailView,
@@ -32,7 +40,16 @@ from docbox.forms import (
     NewTransactionForm,
     ProviderForm,
 )
-from docbox.models import Client, Order, Provider, ProviderOrder, Transaction
+from docbox.models import (
+    CashboxCheckpoint,
+    Client,
+    Order,
+    Provider,
+    ProviderOrder,
+    Transaction,
+    full_text_search,
+)
+from docbox.views.cursor import decode_cursor, encode_cursor
 
 logger = logging.getLogger(__name__)
 DEFAULT_PROVIDER = os.getenv("DEFAULT_PROVIDER", False)
@@ -101,14 +118,49 @@ class ZaoknomView(TemplateView):
 
 
 class ClientsList(LoginRequiredMixin, ListView):
+    """Clients by name, searched by `q` and paginated with the `cursor` of the last client on the page."""
+
     template_name = "docbox/clients-list.html"
     model = Client
+    page_size = 50
+
+    def get(self, request, *args, **kwargs):
+        self.search_q = request.GET.get("q", "").strip()
+        self.after = None
+        if request.GET.get("cursor"):
+            try:
+                name, client_id = decode_cursor(request.GET["cursor"])
+                self.after = name, UUID(client_id)
+            except ValueError:
+                return HttpResponseBadRequest("Неверная ссылка на страницу")
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        queryset = Client.objects.all()
+        if self.search_q:
+            queryset = queryset.search(self.search_q)
+        return queryset.keyset_page(self.after).only("client_id", "name", "phone")[: self.page_size + 1]
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        clients = list(context["object_list"])
+        context["object_list"] = context["client_list"] = clients[: self.page_size]
+        context["next_cursor"] = None
+        if len(clients) > self.page_size:
+            last = clients[self.page_size - 1]
+            context["next_cursor"] = encode_cursor(last.name, last.client_id)
+        # Not `site_q`, it fills the site search in the sidebar.
+        context["client_q"] = self.search_q
+        return context
 
 
 class ClientDetail(LoginRequiredMixin, DetailView):
     template_name = "docbox/client-detail.html"
     model = Client
 
+    def get_queryset(self):
+        return super().get_queryset().with_financials()
+
     def render_to_response(self, context, **response_kwargs):
         if not self.object.client_orders and not self.object.transactions:
             return redirect("docbox:delete-client", pk=self.object.pk)
@@ -324,22 +376,11 @@ class OrdersList(LoginRequiredMixin, DocboxListViewBase):
 
     def get_queryset(self):
 
-        queryset = super().get_queryset()
-        queryset = queryset.filter(date_created__range=(self.start_date, self.end_date))
+        queryset = super().get_queryset().with_balance().with_related()
+        queryset = queryset.list_filter(self.start_date, self.end_date, self.status, self.order_type)
 
         if self.search_q:
-            query = Q(providerorder__code__contains=self.search_q)
-            legacy_query = Q(provider_code__contains=self.search_q)
-            queryset = queryset.filter(query | legacy_query)
-
-        if self.order_type != "all":
-            queryset = queryset.filter(category=self.order_type)
-
-        if self.status == "not_finished":
-            return queryset.exclude(status="finished")
-
-        if self.status != "all":
-            queryset = queryset.filter(status=self.status)
+            queryset = queryset.search_provider_code(self.search_q)
 
         return queryset
 
@@ -390,6 +431,17 @@ class OrderDetail(LoginRequiredMixin, DetailView):
     model = Order
 
 
+class Search(LoginRequiredMixin, TemplateView):
+    template_name = "docbox/search.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Not `search_q`, the order and transaction lists use it for their own filters.
+        context["site_q"] = self.request.GET.get("q", "").strip()
+        context["results"] = full_text_search(context["site_q"]) if context["site_q"] else []
+        return context
+
+
 class TransactionList(LoginRequiredMixin, DocboxListViewBase):
     template_name = "docbox/transactions_list.html"
     model = Transaction
@@ -411,8 +463,7 @@ class TransactionList(LoginRequiredMixin, DocboxListViewBase):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        cashbox_sum = Transaction.objects.filter(cashbox=True).aggregate(Sum("amount"))
-        context["cashbox_sum"] = cashbox_sum.get("amount__sum", 0)
+        context["cashbox_sum"] = CashboxCheckpoint.objects.balance()
         context["providers"] = Provider.objects.all()
         context["selected_provider"] = self.provider
         context["search_q"] = self.search_q
@@ -461,13 +512,6 @@ class NewTransaction(LoginRequiredMixin, FormView):
         form.save()
         return super().form_valid(form)
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["orders_list"] = Order.objects.all().exclude(status="finished")
-        context["clients_list"] = Client.objects.all()
-        context["providers_list"] = Provider.objects.all()
-        return context
-
     def get_initial(self):
         if isinstance(self.object, Order):
             self.initial = [{"order": self.object.order_id, "client": self.object.client.client_id}]
@@ -484,13 +528,6 @@ class EditTransaction(LoginRequiredMixin, DocboxFormViewBase, UpdateView):
     def get_success_url(self):
         return reverse("docbox:transactions-list")
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["orders_list"] = Order.objects.all().exclude(status="finished")
-        context["clients_list"] = Client.objects.all()
-        context["providers_list"] = Provider.objects.all()
-        return context
-
 
 class DeleteTransaction(LoginRequiredMixin, DeleteView):
     model = Transaction
@@ -520,11 +557,6 @@ class NewOrder(LoginRequiredMixin, DocboxFormViewBase):
     initial = {"town": "Белгород-Днестровский"}
     success_url = reverse_lazy("docbox:orders-list")
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context["clients_list"] = Client.objects.all()
-        return context
-
     def form_valid(self, form):
         form.save()
         return super().form_valid(form)
@@ -589,7 +621,6 @@ class EditOrder(LoginRequiredMixin, DocboxFormViewBase):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["clients_list"] = Client.objects.all()
         context["order"] = self.order
         context["transactions_sum"] = self.order.transactions_sum
         return context
@@ -620,38 +651,67 @@ class BookkeepingOrders(OrdersList):
         context["total_price"] = 0
         context["total_expenses"] = 0
         context["total_profit"] = 0
-        for order in self.object_list:
-            context["total_price"] += order.price.products
-            context["total_expenses"] += order.price.expenses
-            context["total_profit"] += order.price.profit
-
+        status_totals = {}
+        category_totals = {}
+        for totals in self.object_list.bookkeeping_totals():
+            context["total_price"] += totals["products_price_sum"]
+            context["total_expenses"] += totals["expenses_sum"]
+            context["total_profit"] += totals["profit_sum"]
+            self.add_subtotals(status_totals, totals["status"], totals)
+            self.add_subtotals(category_totals, totals["category"], totals)
+
+        context["status_totals"] = self.get_subtotals_list(status_totals, Order.Status.choices)
+        context["category_totals"] = self.get_subtotals_list(category_totals, Order.ORDER_TYPE_CHOICES)
         return context
 
+    def add_subtotals(self, subtotals, key, totals):
+        price, expenses, profit = subtotals.get(key, (0, 0, 0))
+        subtotals[key] = (
+            price + totals["products_price_sum"],
+            expenses + totals["expenses_sum"],
+            profit + totals["profit_sum"],
+        )
+
+    def get_subtotals_list(self, subtotals, choices):
+        """Return subtotals as list of (name, price, expenses, profit) in the choices order."""
+        return [(name, *subtotals[key]) for key, name in choices if key in subtotals]
+
 
 class BookkeepingClients(LoginRequiredMixin, DocboxListViewBase):
     template_name = "docbox/bookkeeping-clients.html"
     model = Client
 
+    sort_choices = [
+        ("profit", "прибыль"),
+        ("extra_charge", "наценка"),
+        ("expenses", "расходы"),
+        ("products_price", "цена изделий"),
+    ]
+
     def post(self, request, *args, **kwargs):
         super().post(request, *args, **kwargs)
+        request.session["clients_sort"] = request.POST.get("sort", "profit")
 
         return self.get(request, *args, **kwargs)
 
+    def get(self, request, *args, **kwargs):
+        self.sort = request.session.get("clients_sort", "profit")
+        if self.sort not in dict(self.sort_choices):
+            self.sort = "profit"
+        return super().get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["selected_sort"] = self.sort
+        context["sort_choices"] = self.sort_choices
+        return context
+
     def get_queryset(self):
-        clients = super().get_queryset()
-        queryset = (
-            clients.filter(client_orders__date_created__range=(self.start_date, self.end_date))
-            .distinct()
-            .prefetch_related(
-                Prefetch("client_orders", Order.objects.filter(date_created__range=(self.start_date, self.end_date)))
-            )
-        )
+        date_range = (self.start_date, self.end_date)
+        orders_in_range = Order.objects.filter(client=OuterRef("pk"), date_created__range=date_range)
+        queryset = super().get_queryset().filter(Exists(orders_in_range)).with_financials(date_range).with_profit()
 
-        return sorted(
-            queryset,
-            key=lambda client: client.profit,
-            reverse=True,
-        )
+        return queryset.order_by(f"-{self.sort}_total", "name")
 
 
 class BookkeepingEditOrder(LoginRequiredMixin, DocboxFormViewBase):
@@ -686,16 +746,79 @@ class BookkeepingEditOrder(LoginRequiredMixin, DocboxFormViewBase):
         return context
 
 
+class Echo:
+    """File-like object that returns written value instead of buffering it, for streaming csv."""
+
+    def write(self, value):
+        return value
+
+
 class CsvExport(LoginRequiredMixin, View):
+    """Stream orders as csv.
+
+    Optional GET parameters `start_date`, `end_date`, `status` and `type`
+    filter orders the same way as the orders list, by default all orders are exported.
+    """
+
     def get(self, request, *args, **kwargs):
+        date_format = DocboxListViewBase.date_format
+        start_date = request.GET.get("start_date")
+        end_date = request.GET.get("end_date")
+        try:
+            if start_date and end_date:
+                start_date = make_aware(datetime.strptime(start_date, date_format))
+                end_date = make_aware(datetime.strptime(end_date, date_format))
+        except ValueError:
+            return HttpResponseBadRequest("Дата должна быть в формате дд.мм.гггг")
+
+        orders = Order.objects.list_filter(
+            start_date=start_date,
+            end_date=end_date,
+            status=request.GET.get("status", "all"),
+            category=request.GET.get("type", "all"),
+        )
+
+        writer = csv.writer(Echo())
+        rows = chain([Order.CSV_HEADER], orders.csv_rows())
+
         today = date.today().strftime("%Y%m%d")
         filename = f"orders_{today}.csv"
 
-        response = HttpResponse(content_type="text/csv")
+        response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type="text/csv")
         response["Content-Disposition"] = f'attachment; filename="{filename}"'
 
-        writer = csv.writer(response)
-        for order in Order.objects.all():
-            writer.writerow(order.data_for_csv)
-
         return response
+
+
+class AutocompleteBase(LoginRequiredMixin, View):
+    """Items matching the `q` query as json for the form typeaheads, browsers cache them for a minute.
+
+    Items are `autocomplete_rows` of the `queryset`.
+    """
+
+    key = None
+    queryset = None
+    default_limit = 20
+    max_limit = 50
+
+    @method_decorator(cache_control(private=True, max_age=60))
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get("q", "").strip()
+        limit = request.GET.get("limit", "")
+        limit = min(int(limit), self.max_limit) if limit.isdigit() and int(limit) else self.default_limit
+        return JsonResponse({self.key: self.queryset.all().autocomplete_rows(query, limit)})
+
+
+class AutocompleteClients(AutocompleteBase):
+    key = "clients"
+    queryset = Client.objects.all()
+
+
+class AutocompleteOrders(AutocompleteBase):
+    key = "orders"
+    queryset = Order.objects.exclude(status=Order.Status.FINISHED)
+
+
+class AutocompleteProviders(AutocompleteBase):
+    key = "providers"
+    queryset = Provider.objects.all()
@@ -7,6 +7,18 @@ $('.date-group input').not("[readonly]").datepicker({
   todayHighlight: true
 });
 
+// Data of a dynamic typeahead source, items matching the typed query are loaded from the autocomplete `url`.
+function autocompleteData(url, key) {
+  return function () {
+    var deferred = $.Deferred();
+    fetch(url + "?q=" + encodeURIComponent(this.query), {credentials: "same-origin"})
+      .then(function (response) { return response.json(); })
+      .then(function (data) { deferred.resolve(data[key]); })
+      .catch(function () { deferred.reject(); });
+    return deferred;
+  };
+}
+
 (function () {
   'use strict'
 
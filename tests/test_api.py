@@ -1,9 +1,29 @@
+import json
 import os
+import threading
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from uuid import uuid4
 
+from django.core.management import call_command
+from django.db import connection
 from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 
-from docbox.models import ProviderOrder
+from docbox.management.commands import sendnotifications
+from docbox.models import (
+    CHANGE_GAP_TIMEOUT,
+    CashboxCheckpoint,
+    ChangeLog,
+    DeliveryNotification,
+    Order,
+    Provider,
+    ProviderOrder,
+    Transaction,
+)
 
 from .base import BaseTestCase
 
@@ -36,3 +56,319 @@ class BulkUpdateProviderOrderCase(BaseTestCase):
             self.order3.code: {"delivery_date": self.order3.delivery_date.isoformat(), "status": self.order3.status},
         }
         self.assertDictEqual(data, updated_data)
+
+    def test_order_status(self):
+        data = {code: {"status": "in_production"} for code in ["322001", "322002", "322003"]}
+        self.client.post(self.url, data=data, content_type="application/json", HTTP_Authorization=DOCBOX_TOKEN)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "in_production")
+
+        self.client.post(
+            self.url,
+            data={"322001": {"status": "delivered"}},
+            content_type="application/json",
+            HTTP_Authorization=DOCBOX_TOKEN,
+        )
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "in_production")
+
+    def test_number_of_queries(self):
+        provider_orders = [
+            ProviderOrder(order=self.order, provider=self.provider, code=f"4000{number:02}", price=100)
+            for number in range(50)
+        ]
+        ProviderOrder.objects.bulk_create(provider_orders)
+        data = {provider_order.code: {"status": "in_production"} for provider_order in provider_orders}
+        data.update({code: {"status": "in_production"} for code in ["322001", "322002", "322003", "missing"]})
+
+        # savepoint, provider orders, bulk update, statuses, order status update, two change log inserts, release
+        with self.assertNumQueries(8):
+            response = self.client.post(
+                self.url, data=data, content_type="application/json", HTTP_Authorization=DOCBOX_TOKEN
+            )
+        self.assertEqual(response.json()["error_messages"], ["Provider code 'missing' doesn't exist."])
+        self.assertEqual(ProviderOrder.objects.filter(status="in_production").count(), 53)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "in_production")
+
+
+class ListProviderOrdersCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.url = reverse("docbox-api:list-provider-orders")
+        other_provider = Provider.objects.create(name="Другой поставщик")
+        now = timezone.now()
+        provider_orders = []
+        for number in range(7):
+            provider_orders.append(
+                ProviderOrder(
+                    order=self.order,
+                    provider=other_provider if number % 2 else self.provider,
+                    code=f"60000{number}",
+                    # Two provider orders on each creation date to check the tie breaker.
+                    creation_date=now - timedelta(days=number // 2),
+                    delivery_date=date(2021, 7, 10 + number),
+                    status="delivered" if number < 2 else "new",
+                )
+            )
+        ProviderOrder.objects.bulk_create(provider_orders)
+
+    def get(self, **params):
+        return self.client.get(self.url, params, HTTP_Authorization=DOCBOX_TOKEN).json()
+
+    def test_walk_all_pages(self):
+        codes = []
+        params = {"limit": 3, "fields": "code"}
+        # one select for each of three pages, in request savepoints
+        with self.assertNumQueries(9):
+            while True:
+                data = self.get(**params)
+                codes += [row["code"] for row in data["provider_order_list"]]
+                if not data["next_cursor"]:
+                    break
+                params["cursor"] = data["next_cursor"]
+
+        self.assertEqual(data["provider_order_list"], [{"code": codes[-1]}])
+        expected = ProviderOrder.objects.order_by("-creation_date", "-provider_order_id").values_list("code", flat=True)
+        self.assertEqual(codes, list(expected))
+
+    def test_filters(self):
+        data = self.get(status="new", provider=self.provider.name, delivery_date_from="2021-07-13")
+        self.assertEqual([row["code"] for row in data["provider_order_list"]], ["600004", "600006"])
+        self.assertEqual(data["provider_order_list"][0]["provider"], self.provider.name)
+        self.assertIsNone(data["next_cursor"])
+
+    def test_invalid_params(self):
+        self.assertEqual(self.get(fields="code,secret")["error_messages"], ["Unknown fields: secret"])
+        self.assertEqual(self.get(cursor="bad")["status"], "error")
+        self.assertEqual(self.get(limit="-1")["status"], "error")
+        self.assertEqual(self.get(delivery_date_to="11.07.2021")["status"], "error")
+
+
+class SearchOrderCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.url = reverse("docbox-api:search-order")
+        ProviderOrder.objects.create(order=self.order, provider=self.provider, code="812001")
+        ProviderOrder.objects.create(order=self.order, provider=self.provider, code="812002")
+
+    def search(self, provider_code):
+        return self.client.get(self.url, {"provider_code": provider_code}, HTTP_Authorization=DOCBOX_TOKEN).json()
+
+    def test_order_found_once(self):
+        results = self.search("8120")["search_results"]
+        self.assertEqual([result["id"] for result in results], [str(self.order.pk)])
+        self.assertEqual(results[0]["provider_order"], "812002, 812001")
+
+    def test_legacy_provider_code(self):
+        self.assertEqual(len(self.search("1112")["search_results"]), 1)
+
+    def test_nothing_found(self):
+        self.assertEqual(self.search("999")["error_messages"], ["Nothing found"])
+
+
+class ChangesFeedCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.url = reverse("docbox-api:changes")
+        self.since = ChangeLog.objects.last_change_id()
+
+    def get(self, etag=None, **params):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get(self.url, {"since": self.since, **params}, HTTP_Authorization=DOCBOX_TOKEN, **headers)
+
+    def test_changes(self):
+        transaction = Transaction.objects.create(amount=300, order=self.order, client=self.order.client)
+        provider_order = ProviderOrder.objects.create(order=self.order, provider=self.provider, code="700001")
+        ProviderOrder.objects.filter(pk=provider_order.pk).update(status="delivered")
+        Transaction.objects.filter(pk=transaction.pk).delete()
+
+        data = self.get().json()
+        changes = [(change["model"], change["action"]) for change in data["changes"]]
+        self.assertEqual(changes, [("providerorder", "updated"), ("transaction", "deleted")])
+        self.assertEqual(data["changes"][0]["data"]["status"], "delivered")
+        self.assertIsNone(data["changes"][1]["data"])
+
+        self.since = data["next_since"]
+        self.assertEqual(self.get().json()["changes"], [])
+
+    def test_changes_after_gap_wait(self):
+        ChangeLog.objects.log(Order, [uuid4() for _ in range(3)], ChangeLog.Action.CREATED)
+        change_ids = list(ChangeLog.objects.filter(change_id__gt=self.since).values_list("change_id", flat=True))
+        # Same as a change which isn't committed yet or is rolled back.
+        ChangeLog.objects.filter(pk=change_ids[1]).delete()
+        self.assertEqual([change["change_id"] for change in self.get().json()["changes"]], change_ids[:1])
+
+        ChangeLog.objects.filter(pk=change_ids[2]).update(changed=timezone.now() - CHANGE_GAP_TIMEOUT)
+        self.assertEqual(len(self.get().json()["changes"]), 2)
+
+    def test_pages(self):
+        for number in range(3):
+            ProviderOrder.objects.create(order=self.order, provider=self.provider, code=f"70000{number}")
+
+        data = self.get(limit=2).json()
+        self.assertTrue(data["has_more"])
+        self.since = data["next_since"]
+        data = self.get(limit=2).json()
+        self.assertEqual([change["data"]["code"] for change in data["changes"]], ["700002"])
+        self.assertFalse(data["has_more"])
+
+    def test_pages_with_etag(self):
+        for number in range(3):
+            ProviderOrder.objects.create(order=self.order, provider=self.provider, code=f"70000{number}")
+
+        r = self.get(limit=2)
+        self.since = r.json()["next_since"]
+        # The next page isn't the same response, although nothing was changed since the previous one.
+        r = self.get(etag=r["ETag"], limit=2)
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual([change["data"]["code"] for change in r.json()["changes"]], ["700002"])
+        self.assertEqual(self.get(etag=r["ETag"], limit=2).status_code, 304)
+
+    def test_not_modified(self):
+        r = self.get()
+        # savepoint, last change id, release
+        with self.assertNumQueries(3):
+            r = self.get(etag=r["ETag"])
+        self.assertEqual(r.status_code, 304)
+
+        self.order.save()
+        self.assertEqual(self.get(etag=r["ETag"]).status_code, 200)
+
+
+class StubBotHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.messages.append(json.loads(body)["text"])
+        self.send_response(self.server.response_status)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DeliveryNotificationCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubBotHandler)
+        self.server.messages = []
+        self.server.response_status = 200
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        bot_url = f"http://127.0.0.1:{self.server.server_port}/sendMessage"
+        self.settings_override = override_settings(TELEGRAM_SEND_MESSAGE_URL=bot_url)
+        self.settings_override.enable()
+
+        for number in range(3):
+            ProviderOrder.objects.create(order=self.order, provider=self.provider, code=f"50000{number}", price=100)
+        self.data = {
+            "500000": {"delivery_date": "2021-07-11"},
+            "500001": {"delivery_date": "2021-07-11"},
+            "500002": {"delivery_date": "2021-07-12"},
+        }
+        self.url = reverse("docbox-api:bulk-update-provider-order")
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def post(self, data):
+        self.client.post(self.url, data=data, content_type="application/json", HTTP_Authorization=DOCBOX_TOKEN)
+
+    def test_notifications_are_queued(self):
+        self.post(self.data)
+        self.assertEqual(self.server.messages, [])
+        self.assertEqual(DeliveryNotification.objects.pending().count(), 3)
+
+        r = self.client.get(reverse("docbox-api:notifications-queue"), HTTP_Authorization=DOCBOX_TOKEN)
+        self.assertEqual(r.json()["queued"], 3)
+
+    def test_messages_per_delivery_date(self):
+        self.post(self.data)
+        self.post({"500000": {"delivery_date": "2021-07-12"}})
+        call_command("sendnotifications", once=True, stdout=StringIO())
+
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertIn("*500001*", self.server.messages[0])
+        self.assertNotIn("*500000*", self.server.messages[0])
+        self.assertEqual(self.server.messages[1].count("*500000*"), 1)
+        self.assertEqual(DeliveryNotification.objects.filter(sent__isnull=True).count(), 0)
+
+    def test_date_changed_after_claim(self):
+        self.post(self.data)
+        claim = sendnotifications.Command.claim
+
+        def claim_and_change_date(command, batch_size):
+            notifications = claim(command, batch_size)
+            self.post({"500002": {"delivery_date": "2021-07-13"}})
+            return notifications
+
+        with mock.patch.object(sendnotifications.Command, "claim", claim_and_change_date):
+            call_command("sendnotifications", once=True, stdout=StringIO())
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertNotIn("*500002*", self.server.messages[0])
+        outdated = DeliveryNotification.objects.get(provider_order__code="500002", delivery_date=date(2021, 7, 12))
+        self.assertEqual(outdated.error, "Дата доставки изменилась")
+
+        call_command("sendnotifications", once=True, stdout=StringIO())
+        self.assertIn("Доставка 2021-07-13", self.server.messages[1])
+
+    def test_retry_with_backoff(self):
+        self.server.response_status = 502
+        self.post(self.data)
+        call_command("sendnotifications", once=True, stdout=StringIO(), stderr=StringIO())
+
+        notification = DeliveryNotification.objects.get(provider_order__code="500002")
+        self.assertEqual(notification.attempts, 1)
+        self.assertIn("502", notification.error)
+        self.assertGreater(notification.next_attempt, timezone.now())
+        self.assertEqual(DeliveryNotification.objects.pending().count(), 0)
+
+        self.server.response_status = 200
+        DeliveryNotification.objects.update(next_attempt=timezone.now())
+        call_command("sendnotifications", once=True, stdout=StringIO())
+        self.assertEqual(len(self.server.messages), 4)
+        notification.refresh_from_db()
+        self.assertEqual(notification.attempts, 2)
+        self.assertEqual(notification.delivery_date, date(2021, 7, 12))
+        self.assertIsNotNone(notification.sent)
+
+    def test_delivery_digest(self):
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        ProviderOrder.objects.filter(code__in=["500000", "500001"]).update(delivery_date=tomorrow)
+        ProviderOrder.objects.filter(code="500002").update(delivery_date=tomorrow + timedelta(days=1))
+
+        with self.assertNumQueries(1):
+            call_command("deliverydigest", send=True, stdout=StringIO())
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertIn(f"Доставка {tomorrow.isoformat()}", self.server.messages[0])
+        self.assertIn("*500001*: Тестовый Заказчик", self.server.messages[0])
+        self.assertNotIn("500002", self.server.messages[0])
+
+
+class GetBalanceCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.url = reverse("docbox-api:get-balance")
+        Transaction.objects.create(amount=1000, date=timezone.now() - timedelta(days=3))
+        Transaction.objects.create(amount=500, date=timezone.now())
+        CashboxCheckpoint.objects.create_checkpoints(until=timezone.localdate() - timedelta(days=1))
+
+    def test_current_balance(self):
+        r = self.client.get(self.url, HTTP_Authorization=DOCBOX_TOKEN)
+        self.assertEqual(r.json()["balance"], "1500")
+
+    def test_balance_at_date(self):
+        balance_date = (timezone.localdate() - timedelta(days=1)).isoformat()
+        r = self.client.get(self.url, {"date": balance_date}, HTTP_Authorization=DOCBOX_TOKEN)
+        self.assertDictEqual(r.json(), {"balance": "1000", "date": balance_date})
+
+    def test_invalid_date(self):
+        r = self.client.get(self.url, {"date": "01.01.2021"}, HTTP_Authorization=DOCBOX_TOKEN)
+        self.assertEqual(r.json()["status"], "error")
@@ -1,6 +1,36 @@
-from django.test import TestCase
+import csv
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+from datetime import date, timedelta
+from io import StringIO
+from unittest import skipUnless
+from uuid import uuid4
 
-from docbox.models import Client, Order, Price, Transaction
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, connections
+from django.db.transaction import atomic
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from docbox.models import (
+    Address,
+    Backup,
+    CashboxCheckpoint,
+    ChangeLog,
+    Client,
+    ClientBalance,
+    ImportJob,
+    Mounter,
+    Order,
+    Price,
+    Provider,
+    ProviderOrder,
+    Transaction,
+)
 
 
 class OrderModelTestCase(TestCase):
@@ -42,3 +72,547 @@ class OrderModelTestCase(TestCase):
         )
         self.order.refresh_from_db()
         self.assertAlmostEqual(self.order.remaining, -500)
+
+    def test_annotated_balance(self):
+        Transaction.objects.bulk_create(
+            [
+                Transaction(
+                    amount="2000", order=self.order, client=self.buyer, date=timezone.now() - timedelta(days=1)
+                ),
+                Transaction(amount="1500", order=self.order, client=self.buyer, date=timezone.now()),
+            ]
+        )
+        order = Order.objects.with_balance().get(pk=self.order.pk)
+        self.assertEqual(order.paid_sum, 3500)
+        self.assertEqual(order.remaining, 1500)
+        self.assertEqual(order.last_payment_date, self.order.transactions.last().date)
+
+    def test_annotated_balance_with_no_transactions(self):
+        order = Order.objects.with_balance().get(pk=self.order.pk)
+        self.assertEqual(order.remaining, 5000)
+        self.assertIsNone(order.last_payment_date)
+
+
+class OrderStatusTestCase(TestCase):
+    def setUp(self):
+        self.provider = Provider.objects.create(name="Поставщик")
+        client = Client.objects.create(name="Заказчик")
+        self.orders = [Order.objects.create(client=client, price=Price.objects.create(total=1000)) for _ in range(3)]
+        return super().setUp()
+
+    def create_provider_orders(self, statuses):
+        for index, order in enumerate(self.orders):
+            for number, status in enumerate(statuses):
+                ProviderOrder.objects.create(
+                    order=order, provider=self.provider, code=f"{index}-{number}", price=100, status=status
+                )
+
+    def test_status_updated_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.create_provider_orders(["in_production", "in_production"])
+            self.assertEqual(Order.objects.filter(status="new").count(), 3)
+
+        # statuses select, one update for all orders and the change log insert
+        with self.assertNumQueries(3):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(Order.objects.filter(status="in_production").count(), 3)
+
+    def test_rolled_back_orders_are_discarded(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(DatabaseError), atomic():
+                self.create_provider_orders(["in_production"])
+                raise DatabaseError
+            ProviderOrder.objects.create(
+                order=self.orders[0], provider=self.provider, code="last", price=100, status="in_production"
+            )
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(list(Order.objects.filter(status="in_production")), [self.orders[0]])
+
+    def test_mixed_statuses(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_provider_orders(["in_production", "delivered"])
+        self.assertEqual(Order.objects.filter(status="new").count(), 3)
+
+    def test_unchanged_status(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_provider_orders(["new"])
+        with self.assertNumQueries(1):
+            self.assertEqual(Order.objects.all().update_status_from_provider_orders(), 0)
+
+
+def to_csv(row):
+    csv_file = StringIO()
+    csv.writer(csv_file).writerow(row)
+    return csv_file.getvalue()
+
+
+class BackupRowsTestCase(TestCase):
+    def setUp(self):
+        provider = Provider.objects.create(name="Поставщик")
+        self.buyer = Client.objects.create(name="Заказчик", phone="0990000111")
+        self.order = Order.objects.create(
+            client=self.buyer,
+            price=Price.objects.create(total=5000, mounting=400, added_expenses=100),
+            address=Address.objects.create(street="Тестовая", building="10"),
+            mounter=Mounter.objects.create(name=Client.objects.create(name="Монтажник", phone="0990000222")),
+        )
+        ProviderOrder.objects.create(order=self.order, provider=provider, code="101", price=2000)
+        ProviderOrder.objects.create(order=self.order, provider=provider, code="102", price=1000)
+        Order.objects.create(client=self.buyer, price=Price.objects.create(total=1000), provider_code="старый")
+        Transaction.objects.create(amount=2000, order=self.order, client=self.buyer, comment="аванс")
+        Transaction.objects.create(amount=-500, provider=provider, cashbox=False)
+        return super().setUp()
+
+    def test_order_backup_rows(self):
+        orders = Order.objects.order_by("date_created", "pk")
+        # orders and provider order codes for each of two chunks
+        with self.assertNumQueries(3):
+            rows = list(Order.objects.backup_rows(chunk_size=1))
+        for order, (row, bookkeeping_row) in zip(orders, rows):
+            self.assertEqual(to_csv(row), to_csv(order.data_for_csv.values()))
+            self.assertEqual(to_csv(bookkeeping_row), to_csv(order.bookkeeping_data_for_csv.values()))
+
+    def test_transaction_csv_rows(self):
+        transactions = Transaction.objects.order_by("date", "pk")
+        rows = list(Transaction.objects.csv_rows())
+        self.assertEqual(len(rows), 2)
+        for transaction, row in zip(transactions, rows):
+            self.assertEqual(to_csv(row), to_csv(transaction.data_for_csv.values()))
+
+    def test_backup_to_local_storage(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as backup_dir, override_settings(BACKUP_DIR=backup_dir):
+            call_command("backuporders", storage="local", stdout=out)
+            today = date.today().strftime("%Y%m%d")
+            with gzip.open(os.path.join(backup_dir, f"transactions_{today}.csv.gz"), "rt", newline="") as backup:
+                rows = list(csv.reader(backup))
+            self.assertEqual(len(os.listdir(backup_dir)), 5)
+
+        self.assertEqual(rows[0], Transaction.CSV_HEADER)
+        self.assertEqual(len(rows), 3)
+        self.assertIn(f"orders_{today}.csv.gz: 2 rows", out.getvalue())
+
+    def test_incremental_backup_and_restore(self):
+        with tempfile.TemporaryDirectory() as backup_dir, override_settings(BACKUP_DIR=backup_dir):
+            call_command("backuporders", storage="local", stdout=StringIO())
+            transaction = Transaction.objects.create(amount=700, order=self.order, client=self.buyer)
+            ProviderOrder.objects.filter(code="101").update(status="delivered")
+            deleted_order_id = Order.objects.get(provider_code="старый").pk
+            Order.objects.filter(pk=deleted_order_id).delete()
+            ProviderOrder.objects.filter(code="102").delete()
+            call_command("backuporders", storage="local", incremental=True, stdout=StringIO())
+
+            delta = Backup.objects.first()
+            self.assertEqual(delta.kind, Backup.Kind.DELTA)
+            self.assertEqual(delta.manifest["previous"], Backup.objects.last().name)
+            self.assertEqual(delta.manifest["rows"]["docbox.Transaction"], 1)
+            self.assertEqual(delta.manifest["rows"]["docbox.ProviderOrder"], 1)
+            self.assertEqual(len(os.listdir(backup_dir)), 7)
+            self.assertEqual(delta.manifest["deleted"]["docbox.Order"], [str(deleted_order_id)])
+
+            Transaction.objects.filter(pk=transaction.pk).delete()
+            ProviderOrder.objects.filter(code="101").update(status="new")
+            call_command("restorebackup", os.path.join(backup_dir, f"{delta.name}.json"), stdout=StringIO())
+
+        self.assertTrue(Transaction.objects.filter(pk=transaction.pk).exists())
+        self.assertEqual(ProviderOrder.objects.get(code="101").status, "delivered")
+        self.assertFalse(Order.objects.filter(pk=deleted_order_id).exists())
+        self.assertFalse(ProviderOrder.objects.filter(code="102").exists())
+        self.assertEqual(ClientBalance.objects.get(client=self.buyer).paid_total, 2700)
+
+    @skipUnless(connection.vendor == "postgresql", "COPY is supported only by PostgreSQL")
+    def test_snapshot_and_restore(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            call_command("snapshot", snapshot_dir, stdout=StringIO())
+            Transaction.objects.all().delete()
+            Order.objects.filter(pk=self.order.pk).update(status="finished")
+            call_command("restoresnapshot", snapshot_dir, stdout=StringIO())
+
+        self.assertEqual(Transaction.objects.count(), 2)
+        self.assertEqual(ProviderOrder.objects.count(), 2)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, self.order.status)
+        self.assertEqual(ClientBalance.objects.get(client=self.buyer).paid_total, 2000)
+
+    @skipUnless(connection.vendor == "postgresql", "COPY is supported only by PostgreSQL")
+    def test_restore_snapshot_with_wrong_checksum(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            call_command("snapshot", snapshot_dir, stdout=StringIO())
+            with gzip.open(os.path.join(snapshot_dir, "docbox_transaction.copy.gz"), "wb"):
+                pass
+            with self.assertRaises(CommandError):
+                call_command("restoresnapshot", snapshot_dir, stdout=StringIO())
+
+        self.assertEqual(Transaction.objects.count(), 2)
+
+
+class ImportCsvTestCase(TestCase):
+    header = ["Дата", "Номер", "Статус", "Заказчик", "Адрес", "Телефон", "Монтажник", "Монтаж", "Изделия"]
+    lines = [
+        header + ["", "", "", "", "", "", ""],
+        ["01.02.2021", "101", "TRUE", "Иванов", "ул. Тестовая, 1", "990000111", "Петров", "400", "5000"]
+        + ["2000", "01.02.2021", "3400", "05.02.2021", "", "", "0"],
+        ["02.02.2021", "102", "FALSE", "Сидоров", "", "", "Петров", "", "1000", "500", "", "", "", "", "", "500"],
+        ["03.02.2021", "103"],
+    ]
+
+    def setUp(self):
+        self.csv_dir = tempfile.TemporaryDirectory()
+        self.csv_path = os.path.join(self.csv_dir.name, "orders.csv")
+        with open(self.csv_path, "w", newline="") as csv_file:
+            csv.writer(csv_file).writerows(self.lines)
+        return super().setUp()
+
+    def tearDown(self):
+        self.csv_dir.cleanup()
+        return super().tearDown()
+
+    def test_import(self):
+        out = StringIO()
+        call_command("importcsv", self.csv_path, batch_size=1, stdout=out)
+
+        self.assertIn("imported 2, skipped 2", out.getvalue())
+        self.assertIn("Line 4: expected 16 columns, got 2", out.getvalue())
+        order = Order.objects.get(provider_code="101")
+        self.assertEqual(order.client.phone, "0990000111")
+        self.assertEqual(order.status, "finished")
+        self.assertEqual(order.address.address_info, "ул. Тестовая, 1")
+        self.assertEqual(order.price.total, 5400)
+        self.assertEqual(order.transactions_sum, 5400)
+        self.assertEqual(Order.objects.get(provider_code="102").mounter, order.mounter)
+        self.assertEqual(ClientBalance.objects.get(client=order.client).paid_total, 5400)
+
+    def test_import_is_idempotent(self):
+        call_command("importcsv", self.csv_path, stdout=StringIO())
+        out = StringIO()
+        call_command("importcsv", self.csv_path, stdout=out)
+
+        self.assertIn("was already imported", out.getvalue())
+        out = StringIO()
+        call_command("importcsv", self.csv_path, restart=True, stdout=out)
+
+        self.assertIn("Created 0 orders and 0 transactions.", out.getvalue())
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(Client.objects.count(), 3)
+        self.assertEqual(Transaction.objects.count(), 3)
+
+    def test_resume_import(self):
+        ImportJob.objects.create(file_name="orders.csv", file_hash=self.file_hash(), last_line=2)
+        out = StringIO()
+        call_command("importcsv", self.csv_path, stdout=out)
+
+        self.assertIn("Resuming import of orders.csv after line 2.", out.getvalue())
+        self.assertEqual(list(Order.objects.values_list("provider_code", flat=True)), ["102"])
+        self.assertEqual(ImportJob.objects.get().last_line, 4)
+        self.assertIsNotNone(ImportJob.objects.get().finished)
+
+    def test_dry_run(self):
+        with open(self.csv_path, "a", newline="") as csv_file:
+            csv.writer(csv_file).writerow(self.lines[2][:10] + ["31.02.2021"] + self.lines[2][11:])
+        out = StringIO()
+        call_command("importcsv", self.csv_path, dry_run=True, stdout=out)
+
+        self.assertIn("valid 2, skipped 3", out.getvalue())
+        self.assertIn("Line 5: Can't convert 31.02.2021 to the date obj.", out.getvalue())
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(ImportJob.objects.exists())
+
+    def file_hash(self):
+        with open(self.csv_path, "rb") as csv_file:
+            return hashlib.sha256(csv_file.read()).hexdigest()
+
+
+class ClientFinancialsTestCase(TestCase):
+    def setUp(self):
+        self.buyer = Client.objects.create(name="Заказчик")
+        provider = Provider.objects.create(name="Поставщик")
+        for total, mounting, delivery in [(5000, 400, 100), (3000, None, 200)]:
+            price = Price.objects.create(total=total, mounting=mounting, delivery=delivery, added_expenses=300)
+            order = Order.objects.create(client=self.buyer, price=price)
+            ProviderOrder.objects.create(order=order, provider=provider, code=f"{total}", price=total / 2)
+            Transaction.objects.create(amount=1000, order=order, client=self.buyer)
+        return super().setUp()
+
+    def test_annotated_values_match_properties(self):
+        annotated_client = Client.objects.with_financials().get(pk=self.buyer.pk)
+        for name in [
+            "orders_sum",
+            "transactions_sum",
+            "remaining",
+            "products_price",
+            "provider_orders_price",
+            "orders_added_expenses_sum",
+            "expenses",
+            "profit",
+            "extra_charge",
+        ]:
+            self.assertEqual(getattr(annotated_client, name), getattr(self.buyer, name), name)
+
+    def test_client_without_orders(self):
+        client = Client.objects.create(name="Новый заказчик")
+        annotated_client = Client.objects.with_financials().get(pk=client.pk)
+        self.assertEqual(annotated_client.remaining, 0)
+        self.assertEqual(annotated_client.profit, 0)
+
+    def test_financials_in_one_query(self):
+        with self.assertNumQueries(1):
+            client = Client.objects.with_financials().get(pk=self.buyer.pk)
+            client.remaining
+            client.extra_charge
+
+    def test_order_by_profit(self):
+        other_buyer = Client.objects.create(name="Другой заказчик")
+        price = Price.objects.create(total=100000, added_expenses=1000)
+        Order.objects.create(client=other_buyer, price=price)
+        clients = Client.objects.with_financials().with_profit().order_by("-profit_total")
+        self.assertEqual(list(clients), sorted(clients, key=lambda client: client.profit, reverse=True))
+        self.assertEqual(clients.first(), other_buyer)
+
+    def test_financials_date_range(self):
+        start_date = timezone.now() + timedelta(days=1)
+        client = Client.objects.with_financials((start_date, start_date + timedelta(days=1))).get(pk=self.buyer.pk)
+        self.assertEqual(client.products_price, 0)
+        self.assertEqual(client.provider_orders_price, 0)
+
+
+class OrderBookkeepingTotalsTestCase(TestCase):
+    def setUp(self):
+        buyer = Client.objects.create(name="Заказчик")
+        provider = Provider.objects.create(name="Поставщик")
+        for total, added_expenses, category in [(5000, 300, "pvc"), (3000, None, "pvc"), (2000, 100, "blinds")]:
+            price = Price.objects.create(total=total, mounting=200, added_expenses=added_expenses)
+            order = Order.objects.create(client=buyer, price=price, category=category)
+            ProviderOrder.objects.create(order=order, provider=provider, code=f"{total}", price=total / 2)
+            ProviderOrder.objects.create(order=order, provider=provider, code=f"{total}1", price=100)
+        Order.objects.create(client=buyer, price=Price.objects.create(total=1000), category="pvc")
+        return super().setUp()
+
+    def test_totals_match_price_properties(self):
+        totals = list(Order.objects.bookkeeping_totals())
+        orders = Order.objects.all()
+        self.assertEqual(sum(row["products_price_sum"] for row in totals), sum(o.price.products for o in orders))
+        self.assertEqual(sum(row["expenses_sum"] for row in totals), sum(o.price.expenses for o in orders))
+        self.assertEqual(sum(row["profit_sum"] for row in totals), sum(o.price.profit for o in orders))
+
+    def test_totals_grouped_by_category(self):
+        totals = Order.objects.bookkeeping_totals()
+        blinds = [row for row in totals if row["category"] == "blinds"]
+        self.assertEqual(len(blinds), 1)
+        self.assertEqual(blinds[0]["profit_sum"], Order.objects.get(category="blinds").price.profit)
+
+
+class PriceProviderCostTestCase(TestCase):
+    def setUp(self):
+        self.provider = Provider.objects.create(name="Поставщик")
+        self.price = Price.objects.create(total=5000, mounting=500, added_expenses=300)
+        self.order = Order.objects.create(client=Client.objects.create(name="Заказчик"), price=self.price)
+        self.provider_order = ProviderOrder.objects.create(
+            order=self.order, provider=self.provider, code="1001", price=2000
+        )
+        return super().setUp()
+
+    def assertProviderCost(self, provider_cost, profit):
+        self.price.refresh_from_db()
+        self.assertEqual(self.price.provider_cost, provider_cost)
+        self.assertEqual(self.price.profit, profit)
+
+    def test_provider_order_create(self):
+        self.assertProviderCost(2000, 2200)
+
+    def test_provider_order_update(self):
+        self.provider_order.price = 3000
+        self.provider_order.save()
+        self.assertProviderCost(3000, 1200)
+
+    def test_provider_order_delete(self):
+        self.provider_order.delete()
+        self.assertProviderCost(0, 4200)
+
+    def test_provider_order_moved_to_another_order(self):
+        other_price = Price.objects.create(total=1000)
+        other_order = Order.objects.create(client=self.order.client, price=other_price)
+        self.provider_order.order = other_order
+        self.provider_order.save()
+        self.assertProviderCost(0, 4200)
+        other_price.refresh_from_db()
+        self.assertEqual(other_price.provider_cost, 2000)
+
+    def test_provider_order_bulk_update(self):
+        self.provider_order.price = 1000
+        ProviderOrder.objects.bulk_update([self.provider_order], fields=["price"])
+        self.assertProviderCost(1000, 3200)
+
+    def test_provider_order_queryset_update(self):
+        ProviderOrder.objects.filter(code="1001").update(price=2500)
+        self.assertProviderCost(2500, 1700)
+
+    def test_price_save(self):
+        self.price.added_expenses = None
+        self.price.save()
+        self.assertProviderCost(2000, 2500)
+
+    def test_no_expenses(self):
+        self.provider_order.delete()
+        self.price.added_expenses = 0
+        self.price.save()
+        self.assertProviderCost(0, 0)
+
+    def test_rebuild_command(self):
+        Price.objects.update(provider_cost=0, profit=0)
+        self.assertEqual(Price.objects.drifted().count(), 1)
+        with self.assertRaises(CommandError):
+            call_command("rebuildprices", "--check", stdout=StringIO())
+
+        call_command("rebuildprices", stdout=StringIO())
+        self.assertProviderCost(2000, 2200)
+        self.assertFalse(Price.objects.drifted().exists())
+
+
+class ClientBalanceTestCase(TestCase):
+    def setUp(self):
+        self.buyer = Client.objects.create(name="Заказчик")
+        self.price = Price.objects.create(total=5000)
+        self.order = Order.objects.create(client=self.buyer, price=self.price)
+        return super().setUp()
+
+    def assertBalance(self, client, orders_total, paid_total):
+        balance = ClientBalance.objects.get(client=client)
+        self.assertEqual(balance.orders_total, orders_total)
+        self.assertEqual(balance.paid_total, paid_total)
+        self.assertEqual(balance.remaining, orders_total - paid_total)
+
+    def test_order_create(self):
+        self.assertBalance(self.buyer, 5000, 0)
+        self.assertEqual(ClientBalance.objects.get(client=self.buyer).last_activity, self.order.date_created)
+
+    def test_transaction_save_and_delete(self):
+        transaction = Transaction.objects.create(amount=2000, order=self.order, client=self.buyer)
+        self.assertBalance(self.buyer, 5000, 2000)
+        transaction.amount = 3000
+        transaction.save()
+        self.assertBalance(self.buyer, 5000, 3000)
+        transaction.delete()
+        self.assertBalance(self.buyer, 5000, 0)
+
+    def test_price_change(self):
+        self.price.total = 6000
+        self.price.save()
+        self.assertBalance(self.buyer, 6000, 0)
+
+    def test_order_client_switch(self):
+        new_buyer = Client.objects.create(name="Новый заказчик")
+        self.order.client = new_buyer
+        self.order.save()
+        self.assertBalance(self.buyer, 0, 0)
+        self.assertBalance(new_buyer, 5000, 0)
+
+    def test_writes_add_deltas(self):
+        ClientBalance.objects.filter(client=self.buyer).update(paid_total=100, remaining=4900)
+        Transaction.objects.create(amount=2000, order=self.order, client=self.buyer)
+        self.assertBalance(self.buyer, 5000, 2100)
+
+    def test_missing_balance_is_calculated(self):
+        ClientBalance.objects.all().delete()
+        Transaction.objects.create(amount=2000, order=self.order, client=self.buyer)
+        self.assertBalance(self.buyer, 5000, 2000)
+
+    def test_client_remaining_reads_balance(self):
+        Transaction.objects.create(amount=1000, order=self.order, client=self.buyer)
+        client = Client.objects.select_related("balance").get(pk=self.buyer.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(client.remaining, 4000)
+
+    def test_debtors(self):
+        other_buyer = Client.objects.create(name="Другой заказчик")
+        Order.objects.create(client=other_buyer, price=Price.objects.create(total=9000))
+        Transaction.objects.create(amount=5000, client=self.buyer)
+        self.assertEqual([balance.client for balance in ClientBalance.objects.debtors()], [other_buyer])
+
+    def test_reconcile_command(self):
+        Transaction.objects.bulk_create([Transaction(amount=1000, order=self.order, client=self.buyer)])
+        with self.assertRaises(CommandError):
+            call_command("reconcilebalances", stdout=StringIO())
+
+        call_command("reconcilebalances", "--fix", stdout=StringIO())
+        self.assertBalance(self.buyer, 5000, 1000)
+        call_command("reconcilebalances", stdout=StringIO())
+
+    def test_reconcile_after_normal_writes(self):
+        Mounter.objects.create(name=Client.objects.create(name="Монтажник"))
+        newer_order = Order.objects.create(client=self.buyer, price=Price.objects.create(total=1000))
+        newer_order.delete()
+
+        stdout = StringIO()
+        call_command("reconcilebalances", stdout=stdout)
+        self.assertIn("drifted balances: 0, refreshed last activity: 1", stdout.getvalue())
+        self.assertBalance(self.buyer, 5000, 0)
+        self.assertEqual(ClientBalance.objects.get(client=self.buyer).last_activity, self.order.date_created)
+
+
+class CashboxCheckpointTestCase(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+        for days_ago, amount in [(10, 1000), (5, 2000), (5, -500), (1, 300), (0, 100)]:
+            Transaction.objects.create(amount=amount, date=timezone.now() - timedelta(days=days_ago))
+        Transaction.objects.create(amount=7000, date=timezone.now() - timedelta(days=5), cashbox=False)
+        return super().setUp()
+
+    def test_create_checkpoints(self):
+        checkpoints = CashboxCheckpoint.objects.create_checkpoints(until=self.today - timedelta(days=1))
+        self.assertEqual(len(checkpoints), 10)
+        self.assertEqual(CashboxCheckpoint.objects.get(date=self.today - timedelta(days=5)).balance, 2500)
+        self.assertEqual(CashboxCheckpoint.objects.first().balance, 2800)
+
+    def test_balance(self):
+        self.assertEqual(CashboxCheckpoint.objects.balance(), 2900)
+        # Missing checkpoints are created by the first balance call.
+        self.assertEqual(CashboxCheckpoint.objects.count(), 10)
+        with self.assertNumQueries(2):
+            self.assertEqual(CashboxCheckpoint.objects.balance(), 2900)
+
+    def test_balance_at_date(self):
+        CashboxCheckpoint.objects.create_checkpoints(until=self.today - timedelta(days=3))
+        self.assertEqual(CashboxCheckpoint.objects.balance(self.today - timedelta(days=7)), 1000)
+        self.assertEqual(CashboxCheckpoint.objects.balance(self.today - timedelta(days=4)), 2500)
+        self.assertEqual(CashboxCheckpoint.objects.balance(self.today - timedelta(days=1)), 2800)
+        self.assertEqual(CashboxCheckpoint.objects.balance(self.today - timedelta(days=20)), 0)
+
+    def test_backdated_transaction_invalidates_checkpoints(self):
+        CashboxCheckpoint.objects.create_checkpoints(until=self.today - timedelta(days=1))
+        Transaction.objects.create(amount=400, date=timezone.now() - timedelta(days=3))
+        self.assertFalse(CashboxCheckpoint.objects.filter(date__gte=self.today - timedelta(days=3)).exists())
+        self.assertEqual(CashboxCheckpoint.objects.balance(), 3300)
+
+        CashboxCheckpoint.objects.create_checkpoints(until=self.today - timedelta(days=1))
+        self.assertEqual(CashboxCheckpoint.objects.balance(self.today - timedelta(days=1)), 3200)
+
+
+@skipUnless(connection.vendor == "postgresql", "SQLite doesn't run concurrent transactions")
+class ChangeLogVisibilityTestCase(TransactionTestCase):
+    # Ids left by other tests would be a gap before the first change.
+    reset_sequences = True
+
+    def test_changes_after_unfinished_transaction_are_hidden(self):
+        since = ChangeLog.objects.last_change_id()
+        logged = threading.Event()
+        finish = threading.Event()
+
+        def log_in_open_transaction():
+            try:
+                with atomic():
+                    ChangeLog.objects.log(Order, [uuid4()], ChangeLog.Action.CREATED)
+                    logged.set()
+                    finish.wait(10)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=log_in_open_transaction)
+        thread.start()
+        logged.wait(10)
+        ChangeLog.objects.log(Order, [uuid4()], ChangeLog.Action.CREATED)
+        self.assertEqual(ChangeLog.objects.visible(since).count(), 0)
+
+        finish.set()
+        thread.join()
+        self.assertEqual(ChangeLog.objects.visible(since).count(), 2)
@@ -0,0 +1,211 @@
+import csv
+import io
+import os
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.urls import reverse
+
+from docbox.models import (
+    Address,
+    Client,
+    Mounter,
+    Order,
+    Price,
+    ProviderOrder,
+    Transaction,
+    search_queryset,
+)
+from docbox.views.site import ClientsList
+
+from .base import BaseTestCase
+
+
+class OrdersListQueriesCase(BaseTestCase):
+    # savepoint and its release, session, user, count, orders, provider orders prefetch
+    max_queries = 7
+
+    def setUp(self):
+        super().setUp()
+        for number in range(50):
+            client = Client.objects.create(name=f"Заказчик {number}", phone=f"09900{number:05}")
+            mounter = Mounter.objects.create(name=Client.objects.create(name=f"Монтажник {number}"))
+            address = Address.objects.create(street="Тестовая", building=f"{number}")
+            order = Order.objects.create(
+                client=client, price=Price.objects.create(total=5000), address=address, mounter=mounter
+            )
+            ProviderOrder.objects.create(order=order, provider=self.provider, code=f"{number}01", price=1000)
+            ProviderOrder.objects.create(order=order, provider=self.provider, code=f"{number}02", price=1000)
+            Transaction.objects.create(amount=1000, order=order, client=client)
+
+    def test_orders_list_queries(self):
+        with self.assertNumQueries(self.max_queries):
+            r = self.client.get(reverse("docbox:orders-list"))
+        self.assertEqual(len(r.context["object_list"]), 50)
+
+    def test_bookkeeping_orders_queries(self):
+        with self.assertNumQueries(self.max_queries + 1):
+            self.client.get(reverse("docbox:bookkeeping-orders"))
+
+
+class CsvExportCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for number in range(5):
+            order = Order.objects.create(client=self.order.client, price=Price.objects.create(total=1000), status="new")
+            ProviderOrder.objects.create(order=order, provider=self.provider, code=f"{number}01", price=500)
+        self.url = reverse("docbox:export-csv")
+
+    def get_rows(self, data=None):
+        r = self.client.get(self.url, data)
+        content = b"".join(r.streaming_content).decode()
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_export(self):
+        rows = self.get_rows()
+        self.assertEqual(rows[0], Order.CSV_HEADER)
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[1], [str(value) for value in Order.objects.get(pk=self.order.pk).data_for_csv.values()])
+
+    def test_export_filters(self):
+        self.assertEqual(len(self.get_rows({"status": "finished"})), 2)
+        self.assertEqual(len(self.get_rows({"status": "not_finished"})), 6)
+        self.assertEqual(len(self.get_rows({"start_date": "01.11.2019", "end_date": "30.11.2019"})), 2)
+
+    def test_export_queries_dont_depend_on_orders_count(self):
+        with self.assertNumQueries(6):
+            self.get_rows()
+        for number in range(20):
+            Order.objects.create(client=self.order.client, price=Price.objects.create(total=1000))
+        with self.assertNumQueries(6):
+            self.get_rows()
+
+
+class SearchCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        client = Client.objects.create(name="Иванов", phone="0990000222", info="Постоянный заказчик")
+        self.order = Order.objects.create(
+            client=client,
+            price=Price.objects.create(total=5000),
+            address=Address.objects.create(street="Шевченко", building="5"),
+            comment="Установить балкон",
+        )
+        Transaction.objects.create(amount=1000, order=self.order, client=client, comment="Аванс за балкон")
+        Order.objects.create(client=client, price=Price.objects.create(total=1000), comment="Окно на кухню")
+
+    def search(self, q):
+        return self.client.get(reverse("docbox:search"), {"q": q}).context["results"]
+
+    def test_order_matched_by_client_address_or_comment(self):
+        # savepoint and its release, session, user, search
+        with self.assertNumQueries(5):
+            results = self.search("Шевченко")
+        self.assertEqual([(result["kind"], result["object_id"]) for result in results], [("order", self.order.pk)])
+        self.assertEqual(results[0]["url"], reverse("docbox:order-detail", kwargs={"pk": self.order.pk}))
+        self.assertIn(self.order.pk, [result["object_id"] for result in self.search("Установить балкон")])
+        # Words found in different documents of the order don't match it.
+        self.assertEqual(self.search("Шевченко балкон"), [])
+
+    @skipUnless(connection.vendor == "postgresql", "Search vectors are supported only by PostgreSQL")
+    def test_vectors_matched_separately_and_ranked(self):
+        orders = search_queryset(Order.objects.all(), "Шевченко", [("", Order), ("address__", Address)])
+        self.assertIn("UNION", str(orders.query))
+        self.assertNotIn("||", str(orders.query).split("WHERE")[1])
+        self.assertGreater(orders.get().rank, 0)
+
+    def test_mixed_results(self):
+        kinds = sorted(result["kind"] for result in self.search("балкон"))
+        self.assertEqual(kinds, ["order", "transaction"])
+        # Orders are matched by their client too.
+        kinds = sorted(result["kind"] for result in self.search("Постоянный"))
+        self.assertEqual(kinds, ["client", "order", "order"])
+
+    def test_search_api(self):
+        r = self.client.get(
+            reverse("docbox-api:search"), {"q": "кухню"}, HTTP_Authorization=f"Bearer {os.getenv('API_TOKEN')}"
+        )
+        self.assertEqual(r.json()["search_results"][0]["detail"], "Окно на кухню")
+
+    def test_sidebar_keeps_own_query(self):
+        r = self.client.get(reverse("docbox:search"), {"q": "балкон"})
+        self.assertContains(r, 'name="q" value="балкон"')
+        r = self.client.post(
+            reverse("docbox:orders-list"), {"search_q": "123", "start_date": "01.01.2020", "end_date": "01.01.2030"}
+        )
+        self.assertContains(r, 'name="q" value=""')
+
+
+class ClientsListCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        Client.objects.bulk_create(
+            [Client(name=f"Client {number:02}", phone=f"06700000{number:02}") for number in range(12)]
+        )
+        Client.objects.create(name="Petrenko", phone="0991234567")
+
+    def clients(self, **params):
+        return self.client.get(reverse("docbox:clients-list"), params).context
+
+    def test_search_by_name_prefix_and_phone_fragment(self):
+        names = [client.name for client in self.clients(q="pEt")["object_list"]]
+        self.assertEqual(names, ["Petrenko"])
+        names = [client.name for client in self.clients(q="123 45")["object_list"]]
+        self.assertEqual(names, ["Petrenko"])
+        names = [client.name for client in self.clients(q="000001")["object_list"]]
+        self.assertEqual(names, ["Client 01", "Client 10", "Client 11"])
+
+    def test_pages(self):
+        names = []
+        cursor = ""
+        with mock.patch.object(ClientsList, "page_size", 5):
+            for _ in range(3):
+                context = self.clients(q="client", cursor=cursor)
+                names += [client.name for client in context["object_list"]]
+                cursor = context["next_cursor"]
+        self.assertIsNone(cursor)
+        self.assertEqual(names, [f"Client {number:02}" for number in range(12)])
+
+    def test_bad_cursor(self):
+        r = self.client.get(reverse("docbox:clients-list"), {"cursor": "bad"})
+        self.assertEqual(r.status_code, 400)
+
+
+class AutocompleteCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        client = Client.objects.create(name="Petrenko", phone="0991234567")
+        self.order = Order.objects.create(client=client, price=Price.objects.create(total=5000))
+        ProviderOrder.objects.create(order=self.order, provider=self.provider, code="A7701", price=1000)
+        ProviderOrder.objects.create(order=self.order, provider=self.provider, code="A7702", price=1000)
+        Transaction.objects.create(amount=1000, order=self.order, client=client)
+
+    def autocomplete(self, name, **params):
+        r = self.client.get(reverse(f"docbox:autocomplete-{name}"), params)
+        self.assertIn("max-age=60", r["Cache-Control"])
+        return r.json()[name]
+
+    def test_clients(self):
+        self.assertEqual(
+            [client["display"] for client in self.autocomplete("clients", q="123 45")], ["Petrenko (099) 123 4567"]
+        )
+        self.assertEqual(len(self.autocomplete("clients", q="", limit="1")), 1)
+
+    def test_orders(self):
+        # savepoint and its release, session, user, orders, provider orders codes
+        with self.assertNumQueries(6):
+            orders = self.autocomplete("orders", q="770")
+        self.assertEqual(orders[0]["display"], f"{self.order.provider_orders_str} - Petrenko (остаток: 4000 грн.)")
+        self.assertEqual(orders[0]["order_id"], str(self.order.pk))
+        self.assertEqual([order["order_id"] for order in self.autocomplete("orders", q="petr")], [str(self.order.pk)])
+        # Finished orders aren't suggested.
+        self.assertEqual(self.autocomplete("orders", q="1111"), [])
+
+    def test_providers(self):
+        self.assertEqual([provider["name"] for provider in self.autocomplete("providers")], [self.provider.name])
+        self.assertEqual(self.autocomplete("providers", q="nothing"), [])
+
+    def test_forms_without_dumps(self):
+        with self.assertNumQueries(4):
+            r = self.client.get(reverse("docbox:new-transaction"))
+        self.assertContains(r, reverse("docbox:autocomplete-orders"))